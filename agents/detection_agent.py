@@ -1,72 +1,290 @@
 # agents/detection_agent.py
 import json
-from utils.llm_client import call_llm
+import os
+import re
+from typing import List
+from utils.llm_client import get_client
+from utils.config import (
+    VERDICT_CACHE_ENABLED, VERDICT_CACHE_SIZE, VERDICT_CACHE_TTL, VERDICT_CACHE_VOLATILE_FIELDS,
+    DETECTION_BATCH_MAX, DETECTION_BATCH_TOKEN_BUDGET, DETECTION_TOKENS_PER_VERDICT,
+    DETECTION_PROMPT_COMPACT, LLM_CONTEXT_REUSE, PREFILTER_ENABLED, PREFILTER_MODEL_PATH
+)
+from utils.verdict_cache import VerdictCache, fingerprint
+from utils.events import event_json
+from llm.detection_prompt import (
+    build_single_prompt, build_batch_prompt, estimate_tokens, estimate_json_prompt_tokens,
+    compact_log, compact_suffix, compact_batch_suffix, COMPACT_SINGLE_PREFIX, COMPACT_BATCH_PREFIX
+)
+
+BATCH_WRAPPER_KEYS = ("verdicts", "results")  # keys a batch reply may hold its verdict list under
+
 
 class DetectionAgent:
-    def __init__(self, llm_model=None):
+    def __init__(self, llm_model=None, use_cache: bool = VERDICT_CACHE_ENABLED, llm_client=None, prefilter=None):
         self.name = "DetectionAgent"
         self.llm_model = llm_model
+        self.llm = llm_client or get_client()
+        self.cache = VerdictCache(VERDICT_CACHE_SIZE, VERDICT_CACHE_TTL) if use_cache else None
+        self.volatile_fields = list(VERDICT_CACHE_VOLATILE_FIELDS)
+        self.batch_max = DETECTION_BATCH_MAX
+        self.batch_token_budget = DETECTION_BATCH_TOKEN_BUDGET
+        self.compact = DETECTION_PROMPT_COMPACT
+        self.context_reuse = LLM_CONTEXT_REUSE
+        self._contexts = {}  # prompt prefix -> Ollama context (False if the server gave none)
+        self.prefilter = prefilter if prefilter is not None else self._load_prefilter()
+
+    @staticmethod
+    def _load_prefilter():
+        if not PREFILTER_ENABLED or not os.path.exists(PREFILTER_MODEL_PATH):
+            return None
+        from utils.prefilter import LogisticPrefilter
+        return LogisticPrefilter.load(PREFILTER_MODEL_PATH)
 
-    def _make_prompt(self, log: dict) -> str:
+    def _build_request(self, logs: List[dict], batch: bool):
         """
-        Strict prompt: ask LLM to output JSON ONLY with fields:
-        verdict (malicious|benign), score (0.0-1.0), reasons[], recommended_action
+        (prompt to send, Ollama context or None, prompt stats for llm_timing).
+        With context reuse the constant prefix is evaluated once and only the
+        per-call suffix is sent. prompt_tokens_json_est is what the full-JSON
+        prompt would have cost, for comparing prefill (estimated from lengths,
+        the JSON prompt itself is only built when it is the one sent).
         """
-        examples = [
-            {
-                "example_log": {"message":"SSH failed_login attempt from 1.2.3.4","conn_count":1},
-                "example_out": {"verdict":"benign","score":0.12,"reasons":["single failed login, low volume"],"recommended_action":"monitor"}
-            },
-            {
-                "example_log": {"message":"Multiple failed_login and bruteforce pattern from 203.0.113.5","conn_count":120},
-                "example_out": {"verdict":"malicious","score":0.93,"reasons":["high connection count","bruteforce pattern"],"recommended_action":"block_ip"}
-            }
-        ]
-        prompt_lines = [
-            "You are a concise cybersecurity analyst. Given the single JSON log object below, output JSON ONLY with keys:",
-            '  verdict: one of "malicious", "benign", "uncertain"',
-            '  score: float between 0.0 and 1.0 (higher means more malicious) and anything above 0.5 including 0.5 is malicious under is benign',
-            '  reasons: array of short reasoning strings',
-            '  recommended_action: one of "block_ip","notify","monitor"',
-            "",
-            "Here are examples (do NOT hallucinate beyond the fields):",
-        ]
-        for ex in examples:
-            prompt_lines.append("LOG_EXAMPLE: " + json.dumps(ex["example_log"]))
-            prompt_lines.append("OUTPUT_EXAMPLE: " + json.dumps(ex["example_out"]))
-        prompt_lines.append("")
-        prompt_lines.append("Now analyze this log and return JSON only:")
-        prompt_lines.append(json.dumps(log))
-        return "\n".join(prompt_lines)
+        if not self.compact:
+            json_prompt = build_batch_prompt(logs) if batch else build_single_prompt(logs[0])
+            return json_prompt, None, {"prompt_tokens_est": estimate_tokens(json_prompt)}
+
+        prefix = COMPACT_BATCH_PREFIX if batch else COMPACT_SINGLE_PREFIX
+        suffix = compact_batch_suffix(logs) if batch else compact_suffix(logs[0])
+        context = self._context_for(prefix)
+        prompt = suffix if context else prefix + suffix
+        stats = {"prompt_tokens_est": estimate_tokens(prompt),
+                 "prompt_tokens_json_est": estimate_json_prompt_tokens(logs, batch)}
+        if context:
+            stats["prompt_prefix_reused"] = True
+        return prompt, context, stats
+
+    def _context_for(self, prefix: str):
+        if not self.context_reuse:
+            return None
+        context = self._contexts.get(prefix)
+        if context is None:
+            context = self._contexts[prefix] = self.llm.prime(prefix, model=self.llm_model) or False
+        return context or None
 
     def analyze(self, log: dict) -> dict:
-        prompt = self._make_prompt(log)
-        raw = call_llm(prompt, model=self.llm_model)
+        if self.cache is None:
+            return self._prefiltered([log])[0] or self._analyze_llm(log)
+
+        key = fingerprint(log, self.volatile_fields)
+        cached = self.cache.get(key)
+        if cached is not None:
+            cached["cache_hit"] = True
+            return cached
+
+        result = self._prefiltered([log])[0]
+        if result is not None:
+            result["cache_hit"] = False
+            return result
+        result = self._analyze_llm(log)
+        self._remember(key, result)
+        result["cache_hit"] = False
+        return result
+
+    def analyze_many(self, logs: List[dict], executor=None) -> List[dict]:
+        """
+        Analyze several logs, packing cache misses into multi-log prompts sized
+        to the token budget. Chunks run on `executor` when one is given.
+        Results are returned in input order.
+        """
+        results = [None] * len(logs)
+        keys = [None] * len(logs)
+        pending = []
+        duplicates = {}  # index -> index of the identical log sent to the LLM
+        first_by_key = {}
+        for i, log in enumerate(logs):
+            if self.cache is not None:
+                keys[i] = fingerprint(log, self.volatile_fields)
+                if keys[i] in first_by_key:
+                    duplicates[i] = first_by_key[keys[i]]
+                    continue
+                cached = self.cache.get(keys[i])
+                if cached is not None:
+                    cached["cache_hit"] = True
+                    results[i] = cached
+                    continue
+                first_by_key[keys[i]] = i
+            pending.append(i)
+
+        # confident pre-classifier answers skip the LLM (and stay out of the cache)
+        for i, result in zip(pending, self._prefiltered([logs[i] for i in pending])):
+            if result is not None:
+                if self.cache is not None:
+                    result["cache_hit"] = False
+                results[i] = result
+        pending = [i for i in pending if results[i] is None]
 
+        chunks = self._chunk([logs[i] for i in pending])
+        if executor is not None and len(chunks) > 1:
+            chunk_results = list(executor.map(self._analyze_chunk, chunks))
+        else:
+            chunk_results = [self._analyze_chunk(c) for c in chunks]
+
+        flat = [r for rs in chunk_results for r in rs]
+        for i, result in zip(pending, flat):
+            if self.cache is not None:
+                self._remember(keys[i], result)
+                result["cache_hit"] = False
+            results[i] = result
+        for i, j in duplicates.items():
+            results[i] = dict(results[j], cache_hit=True)
+        return results
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats() if self.cache is not None else {}
+
+    def prefilter_stats(self) -> dict:
+        return self.prefilter.stats() if self.prefilter is not None else {}
+
+    def _prefiltered(self, logs: List[dict]) -> List[dict]:
+        """Pre-classifier verdict per log, None where it is unsure (or not loaded)."""
+        if self.prefilter is None:
+            return [None] * len(logs)
+        return self.prefilter.decide_many(logs)
+
+    def _remember(self, key: str, result: dict):
+        # don't pin parse failures / LLM errors in the cache
+        if self.cache is not None and "llm_parse_failed" not in (result.get("reasons") or []):
+            self.cache.put(key, {k: v for k, v in result.items() if k != "llm_timing"})
+
+    def _chunk(self, logs: List[dict]) -> List[List[dict]]:
+        """Greedy split so each prompt's log payload + expected output fits the token budget."""
+        chunks, current, used = [], [], 0
+        for log in logs:
+            payload = compact_log(log) if self.compact else event_json(log)
+            cost = estimate_tokens(payload) + DETECTION_TOKENS_PER_VERDICT
+            if current and (len(current) >= self.batch_max or used + cost > self.batch_token_budget):
+                chunks.append(current)
+                current, used = [], 0
+            current.append(log)
+            used += cost
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _analyze_chunk(self, logs: List[dict]) -> List[dict]:
+        if len(logs) == 1:
+            return [self._analyze_llm(logs[0])]
+
+        prompt, context, stats = self._build_request(logs, batch=True)
+        # JSON mode constrains the reply to one object, hence the {"verdicts": [...]} wrapper
+        raw, timing = self._call_llm(prompt, num_predict=DETECTION_TOKENS_PER_VERDICT * len(logs) + 64,
+                                     stop_when=self._is_batch, context=context)
+        timing.update(stats)
+        by_index = {}
+        for item in self._parse_array(raw):
+            idx = item.get("index")
+            if isinstance(idx, int) and 0 <= idx < len(logs):
+                item = dict(item)
+                item.pop("index")
+                by_index[idx] = self._normalize(item)
+
+        results = []
+        for i, log in enumerate(logs):
+            if i in by_index:
+                by_index[i]["batched"] = len(logs)
+                by_index[i]["llm_timing"] = timing
+                results.append(by_index[i])
+            else:
+                # short or malformed answer for this log → retry it on its own
+                results.append(self._analyze_llm(log))
+        return results
+
+    def _parse_array(self, raw: str) -> list:
+        """
+        Verdict objects of a batch reply: {"verdicts": [...]} (or "results"), or
+        a bare array. Anything else, e.g. a single verdict object, is a failed
+        batch and yields [] so every log is retried on its own.
+        """
         parsed = None
         try:
             parsed = json.loads(raw)
         except Exception:
-            import re
-            m = re.search(r"\{.*\}", raw, flags=re.S)
+            m = re.search(r"[\[{].*[\]}]", raw, flags=re.S)
             if m:
                 try:
                     parsed = json.loads(m.group(0))
                 except Exception:
                     pass
+        if isinstance(parsed, dict):
+            parsed = next((parsed[k] for k in BATCH_WRAPPER_KEYS if isinstance(parsed.get(k), list)), None)
+        if not isinstance(parsed, list):
+            return []
+        return [item for item in parsed if self._well_formed(item)]
+
+    @staticmethod
+    def _score_of(parsed: dict):
+        """The verdict's score as a float in [0, 1], None if it isn't one ("0.8" is accepted)."""
+        try:
+            score = float(parsed.get("score"))
+        except (TypeError, ValueError):
+            return None
+        return score if 0.0 <= score <= 1.0 else None
+
+    @classmethod
+    def _well_formed(cls, parsed) -> bool:
+        """A verdict object _normalize can take: numeric score, string verdict (if given)."""
+        return (isinstance(parsed, dict) and cls._score_of(parsed) is not None
+                and isinstance(parsed.get("verdict", "uncertain"), str))
+
+    def _normalize(self, parsed: dict) -> dict:
+        score = parsed["score"] = self._score_of(parsed)
+        verdict = parsed.get("verdict", "uncertain").lower()
+
+        if score >= 0.5 and verdict != "malicious":
+            parsed["verdict"] = "malicious"
+            parsed["recommended_action"] = parsed.get("recommended_action", "block_ip")
+
+        elif score < 0.5 and verdict != "benign":
+            parsed["verdict"] = "benign"
+            parsed["recommended_action"] = parsed.get("recommended_action", "monitor")
+
+        return parsed
+
+    @staticmethod
+    def _is_verdict(value) -> bool:
+        return isinstance(value, dict) and "verdict" in value and "score" in value
+
+    @staticmethod
+    def _is_batch(value) -> bool:
+        return isinstance(value, list) or (
+            isinstance(value, dict) and any(isinstance(value.get(k), list) for k in BATCH_WRAPPER_KEYS))
 
-        if isinstance(parsed, dict) and "score" in parsed:
-            score = parsed.get("score", 0.5)
-            verdict = parsed.get("verdict", "uncertain").lower()
+    def _call_llm(self, prompt: str, num_predict: int = None, stop_when=None, context=None):
+        """Returns (raw_text, timing); LLM errors come back as an {"error": ...} JSON string."""
+        result = self.llm.generate(prompt, model=self.llm_model, num_predict=num_predict, stop_when=stop_when,
+                                   context=context)
+        if result["error"]:
+            return json.dumps({"error": result["error"]}), result["timing"]
+        return result["text"], result["timing"]
 
-            if score >= 0.5 and verdict != "malicious":
-                parsed["verdict"] = "malicious"
-                parsed["recommended_action"] = parsed.get("recommended_action", "block_ip")
+    def _analyze_llm(self, log: dict) -> dict:
+        prompt, context, stats = self._build_request([log], batch=False)
+        raw, timing = self._call_llm(prompt, stop_when=self._is_verdict, context=context)
+        timing.update(stats)
 
-            elif score < 0.5 and verdict != "benign":
-                parsed["verdict"] = "benign"
-                parsed["recommended_action"] = parsed.get("recommended_action", "monitor")
+        parsed = None
+        try:
+            parsed = json.loads(raw)
+        except Exception:
+            m = re.search(r"\{.*\}", raw, flags=re.S)
+            if m:
+                try:
+                    parsed = json.loads(m.group(0))
+                except Exception:
+                    pass
 
+        if self._well_formed(parsed):
+            parsed = self._normalize(parsed)
+            parsed["llm_timing"] = timing
             return parsed
 
         # fallback if parsing fails entirely
@@ -74,5 +292,6 @@ class DetectionAgent:
             "verdict": "uncertain",
             "score": 0.5,
             "reasons": ["llm_parse_failed", str(raw)[:400]],
-            "recommended_action": "monitor"
+            "recommended_action": "monitor",
+            "llm_timing": timing
         }
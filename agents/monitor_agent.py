@@ -1,98 +1,140 @@
 import os
-import requests
+import argparse
 import json
+import threading
 import time
-from requests.auth import HTTPBasicAuth
-from collections import OrderedDict
+from datetime import datetime
+from utils.graylog_api import GraylogClient, GraylogError, to_graylog_time
+from utils.events import FIELDS_ORDER, SuricataEvent
 
 # === CONFIGURATION ===
-GRAYLOG_URL = "http://192.168.56.10:9000/api/search/universal/relative"
+GRAYLOG_URL = "http://192.168.56.10:9000"
 USERNAME = "admin"
 PASSWORD = "pass123!"
 QUERY = "filebeat_source:suricata AND (event_type:alert OR event_type:fileinfo)"
-RANGE = 5    # last 6 seconds
-LIMIT = 500
+RANGE = 5    # first run only: start this many seconds back
+LIMIT = 500  # page size; pages are fetched until the window is exhausted
 VERIFY_SSL = False
 INTERVAL = 5   # seconds between each query
+OVERLAP = 10   # re-read this many seconds before the high-water mark (late-indexed events)
+INDEX_LAG = 1  # leave the newest second alone, Graylog may still be indexing it
+DEDUP_BUCKET = 60  # seconds per bucket of seen _ids
+BACKFILL_SLICES = 96   # sub-ranges a backfill is split into (15 min each for a day)
+BACKFILL_WORKERS = 4   # parallel sub-range fetches
 # ======================
 
 # Automatically resolve path to data/logs.ndjson
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(BASE_DIR)
 OUTFILE = os.path.join(PROJECT_ROOT, "data", "logs.ndjson")
+CURSOR_FILE = os.path.join(PROJECT_ROOT, "data", "monitor_cursor.json")
 
-# Unified field order (works for both alert and fileinfo)
-FIELDS_ORDER = [
-    # Common metadata
-    "timestamp", "event_type", "app_proto", "proto",
-    "src_ip", "src_port", "dest_ip", "dest_port", "direction",
+def parse_time(value) -> float:
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return time.time()
 
-    # Alert-specific fields
-    "alert_signature_id", "alert_signature", "alert_rev",
-    "alert_severity", "alert_action", "alert_category",
 
-    # Fileinfo-specific fields
-    "fileinfo_filename", "fileinfo_size", "fileinfo_state", "fileinfo_stored",
+_client = None
 
-    # HTTP-related fields
-    "http_protocol", "http_hostname", "http_http_method",
-    "http_url", "http_status", "http_http_content_type",
 
-    # Flow-related stats
-    "flow_id", "flow_pkts_toserver", "flow_pkts_toclient",
-    "flow_bytes_toserver", "flow_bytes_toclient", "flow_start",
+def get_client() -> GraylogClient:
+    global _client
+    if _client is None:
+        _client = GraylogClient(GRAYLOG_URL, USERNAME, PASSWORD, verify=VERIFY_SSL)
+    return _client
 
-    # Sensor/host info
-    "source", "filebeat_host_name", "_id"
-]
 
+def fetch_window(time_from: float, time_to: float):
+    """
+    Page through every message in [time_from, time_to).
+    Returns (messages, complete); complete is False if a page failed, in which
+    case the cursor must not move past this window.
+    """
+    messages = []
+    try:
+        for msg in get_client().search(QUERY, time_from, time_to, limit=LIMIT):
+            messages.append(msg)
+    except GraylogError as e:
+        print(e)
+        return messages, False
+    return messages, True
+
+
+class SeenIds:
+    """
+    Bounded memory of already-written Graylog _ids, grouped in time buckets
+    by event timestamp. Buckets older than the overlap window can never be
+    re-fetched, so they are dropped.
+    """
+
+    def __init__(self, bucket_seconds: int = DEDUP_BUCKET, horizon: float = OVERLAP + DEDUP_BUCKET):
+        self.bucket_seconds = bucket_seconds
+        self.horizon = horizon
+        self._buckets = {}  # bucket start -> set of _ids
+
+    def _bucket(self, ts: float) -> int:
+        return int(ts // self.bucket_seconds) * self.bucket_seconds
+
+    def has(self, msg_id: str, ts: float) -> bool:
+        # neighbouring buckets too, in case the timestamp was re-parsed differently
+        b = self._bucket(ts)
+        return any(msg_id in self._buckets.get(k, ()) for k in (b - self.bucket_seconds, b, b + self.bucket_seconds))
+
+    def add(self, msg_id: str, ts: float):
+        self._buckets.setdefault(self._bucket(ts), set()).add(msg_id)
+
+    def evict(self, high_water: float):
+        cutoff = self._bucket(high_water - self.horizon)
+        for b in [b for b in self._buckets if b < cutoff]:
+            del self._buckets[b]
+
+    def to_dict(self):
+        return {str(b): sorted(ids) for b, ids in self._buckets.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        seen = cls()
+        seen._buckets = {int(b): set(ids) for b, ids in (data or {}).items()}
+        return seen
+
+
+def load_cursor():
+    """Returns (high_water_mark, SeenIds) persisted by the previous run, if any."""
+    try:
+        with open(CURSOR_FILE, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        return float(state["high_water"]), SeenIds.from_dict(state.get("seen"))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, SeenIds()
 
-def fetch_graylog():
-    """Fetch JSON logs from Graylog API."""
-    params = {
-        "query": QUERY,
-        "range": RANGE,
-        "limit": LIMIT,
-        "sort": "timestamp:desc"
-    }
-    headers = {"Accept": "application/json"}
 
-    try:
-        resp = requests.get(
-            GRAYLOG_URL,
-            params=params,
-            auth=HTTPBasicAuth(USERNAME, PASSWORD),
-            headers=headers,
-            verify=VERIFY_SSL,
-            timeout=30
-        )
-        if resp.status_code != 200:
-            print(f"Graylog returned status {resp.status_code}")
-            return None
-        return resp.json()
-    except requests.RequestException as e:
-        print(f"Connection error: {e}")
-        return None
-
-
-def extract_nested(msg, key):
-    """Safely extract nested Suricata fields if Graylog didn’t flatten them."""
-    if key in msg:
-        return msg[key]
-
-    if key.startswith("http_"):
-        http = msg.get("http", {})
-        return http.get(key.replace("http_", ""))
-    if key.startswith("fileinfo_"):
-        fileinfo = msg.get("fileinfo", {})
-        return fileinfo.get(key.replace("fileinfo_", ""))
-    if key.startswith("flow_"):
-        flow = msg.get("flow", {})
-        return flow.get(key.replace("flow_", ""))
-    if key.startswith("alert_"):
-        alert = msg.get("alert", {})
-        return alert.get(key.replace("alert_", ""))
-    return None
+def save_cursor(high_water: float, seen: SeenIds):
+    os.makedirs(os.path.dirname(CURSOR_FILE), exist_ok=True)
+    tmp = CURSOR_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"high_water": high_water, "seen": seen.to_dict()}, f)
+    os.replace(tmp, CURSOR_FILE)
+
+
+def dedup(messages, seen: SeenIds):
+    """Drop messages whose _id was already written; returns the new ones."""
+    fresh = []
+    for msg in messages:
+        msg_id = msg.get("_id")
+        ts = parse_time(msg.get("timestamp"))
+        if msg_id is not None:
+            if seen.has(msg_id, ts):
+                continue
+            seen.add(msg_id, ts)
+        fresh.append(msg)
+    return fresh
+
+
+def format_log(msg) -> SuricataEvent:
+    """Project a Graylog message onto FIELDS_ORDER (flat key, else the nested Suricata object)."""
+    return SuricataEvent.from_message(msg)
 
 
 def extract_logs(data):
@@ -101,14 +143,7 @@ def extract_logs(data):
         return []
 
     messages = data.get("messages", [])
-    formatted_logs = []
-
-    for entry in messages:
-        msg = entry.get("message", {})
-        log = OrderedDict()
-        for field in FIELDS_ORDER:
-            log[field] = extract_nested(msg, field)
-        formatted_logs.append(log)
+    formatted_logs = [format_log(entry.get("message", {})) for entry in messages]
 
     alerts = sum(1 for l in formatted_logs if l.get("event_type") == "alert")
     fileinfo = sum(1 for l in formatted_logs if l.get("event_type") == "fileinfo")
@@ -125,21 +160,82 @@ def write_logs(logs):
     os.makedirs(os.path.dirname(OUTFILE), exist_ok=True)
     with open(OUTFILE, "a", encoding="utf-8") as f:
         for log in logs:
-            f.write(json.dumps(log, ensure_ascii=False) + "\n")
+            f.write(log.to_json() + "\n")
 
     print(f"Appended {len(logs)} logs to {OUTFILE}")
 
 
-def main_loop():
-    """Continuously query Graylog every INTERVAL seconds."""
+def poll_once(high_water, seen: SeenIds, sink=write_logs):
+    """
+    One cycle: fetch everything between the high-water mark (minus OVERLAP)
+    and now, drop already-written _ids, hand the rest to `sink` (by default
+    append them to OUTFILE). The cursor is saved only after sink returns.
+    Returns (new_high_water, written_logs).
+    """
+    now = time.time() - INDEX_LAG
+    time_from = (now - RANGE) if high_water is None else (high_water - OVERLAP)
+
+    messages, complete = fetch_window(time_from, now)
+    fresh = dedup(messages, seen)
+    logs = extract_logs({"messages": [{"message": m} for m in fresh]})
+    sink(logs)
+    print(f"→ fetched {len(messages)} | deduped {len(messages) - len(fresh)} | written {len(logs)}")
+
+    if complete:
+        high_water = now
+    elif fresh:
+        # partial window: only advance as far as what we actually wrote
+        high_water = max(parse_time(m.get("timestamp")) for m in fresh)
+    if high_water is not None:
+        seen.evict(high_water)
+        save_cursor(high_water, seen)
+    return high_water, logs
+
+
+def main_loop(sink=write_logs, stop: threading.Event = None):
+    """
+    Continuously query Graylog every INTERVAL seconds until `stop` is set.
+    A blocking sink (e.g. a full in-process queue) delays the next poll.
+    """
+    stop = stop or threading.Event()
     print(f"Starting Graylog fetch loop (every {INTERVAL}s)")
-    while True:
-        data = fetch_graylog()
-        logs = extract_logs(data)
-        write_logs(logs)
+    high_water, seen = load_cursor()
+    if high_water is not None:
+        print(f"Resuming from {to_graylog_time(high_water)}")
+    while not stop.is_set():
+        high_water, _ = poll_once(high_water, seen, sink)
         print(f"Waiting {INTERVAL}s...\n")
-        time.sleep(INTERVAL)
+        stop.wait(INTERVAL)
+
+
+def backfill(hours: float, slices: int = BACKFILL_SLICES, workers: int = BACKFILL_WORKERS, chunk: int = 5000):
+    """
+    Pull the last `hours` of history through the streaming CSV export,
+    `workers` sub-ranges at a time, appending to OUTFILE in chunks so
+    memory stays bounded.
+    """
+    time_to = time.time() - INDEX_LAG
+    time_from = time_to - hours * 3600
+    print(f"Backfilling {to_graylog_time(time_from)} → {to_graylog_time(time_to)} "
+          f"({slices} slices, {workers} workers)")
+    started, total, logs = time.time(), 0, []
+    for msg in get_client().backfill(QUERY, time_from, time_to, FIELDS_ORDER, slices=slices, workers=workers):
+        logs.append(format_log(msg))
+        if len(logs) >= chunk:
+            write_logs(logs)
+            total += len(logs)
+            logs = []
+    write_logs(logs)
+    total += len(logs)
+    print(f"Backfill done: {total} logs in {time.time() - started:.1f}s")
 
 
 if __name__ == "__main__":
-    main_loop()
+    parser = argparse.ArgumentParser(description="Graylog → data/logs.ndjson")
+    parser.add_argument("--backfill", type=float, metavar="HOURS",
+                        help="pull this many hours of history, then exit")
+    args = parser.parse_args()
+    if args.backfill:
+        backfill(args.backfill)
+    else:
+        main_loop()
@@ -4,10 +4,31 @@ import math
 from typing import Dict, Any, List
 from utils.config import (
     LOCAL_LOG_PATH, RBF_KEYWORDS, RBF_CONN_COUNT_THRESHOLD, RBF_PKTS_THRESHOLD,
-    RBF_BYTES_THRESHOLD, SCORE_THRESHOLD_SUSPICIOUS
+    RBF_BYTES_THRESHOLD, SCORE_THRESHOLD_SUSPICIOUS, RBF_TEXT_FIELDS,
+    RBF_SCAN_DISTINCT_PORTS, RBF_BRUTEFORCE_FLOWS, RBF_BRUTEFORCE_PORTS,
+    RBF_REPEAT_SIGNATURE_ALERTS, RBF_AGG_CONCLUSIVE, RBF_AGG_KEY_RULES, COALESCE_ENABLED
 )
 from utils.db_logger import log_trace
+from utils.keyword_matcher import KeywordMatcher
+from utils.host_stats import HostAggregator, flow_initiator
 from core.state import StateStore
+from core.coalesce import AlertCoalescer
+
+def _as_int(value) -> int:
+    """int() coercion used by the numeric rules; anything unparsable counts as 0."""
+    try:
+        return int(value or 0)
+    except Exception:
+        return 0
+
+
+def _to_client(log) -> bool:
+    return (log.get("direction") or "").lower() == "to_client"
+
+
+_BRUTEFORCE_PORTS = frozenset(RBF_BRUTEFORCE_PORTS)
+_AGG_KEY_RULES = frozenset(RBF_AGG_KEY_RULES)
+
 
 class PlannerAgent:
     def __init__(self, detector, responder):
@@ -15,6 +36,10 @@ class PlannerAgent:
         self.detector = detector
         self.responder = responder
         self.state = StateStore()
+        self.keyword_matcher = KeywordMatcher(RBF_KEYWORDS, RBF_TEXT_FIELDS)
+        self.aggregator = HostAggregator()
+        self.coalescer = AlertCoalescer() if COALESCE_ENABLED else None
+        self._parked = {}  # id(trace) -> Future for alerts waiting on their burst leader
 
     def load_logs(self, path: str = LOCAL_LOG_PATH) -> List[Dict[str, Any]]:
         logs = []
@@ -32,35 +57,25 @@ class PlannerAgent:
             return []
         return logs
 
-    def rule_based_check(self, log: Dict[str, Any]) -> Dict[str, Any]:
+    def rule_based_check(self, log: Dict[str, Any], keywords: List[str] = None) -> Dict[str, Any]:
+        """Rule score for one log; `keywords` are its KeywordMatcher hits when already known (plan_many)."""
         score = 0.0
         matched = []
-        text = json.dumps(log).lower()
-
-        for kw in RBF_KEYWORDS:
-            if kw in text:
-                score += 0.25
-                matched.append(f"keyword:{kw}")
+        for kw in self.keyword_matcher.match(log) if keywords is None else keywords:
+            score += 0.25
+            matched.append(f"keyword:{kw}")
 
-        conn_like = log.get("conn_count") or log.get("flow_pkts_toserver") or log.get("flow_pkts_toclient") or 0
-        try:
-            conn_like = int(conn_like)
-        except Exception:
-            conn_like = 0
+        conn_like = _as_int(log.get("conn_count") or log.get("flow_pkts_toserver") or log.get("flow_pkts_toclient"))
         if conn_like > RBF_PKTS_THRESHOLD:
             score += 0.3
             matched.append("high_pkts_conn")
 
-        bytes_like = log.get("flow_bytes_toserver") or log.get("flow_bytes_toclient") or 0
-        try:
-            bytes_like = int(bytes_like)
-        except Exception:
-            bytes_like = 0
+        bytes_like = _as_int(log.get("flow_bytes_toserver") or log.get("flow_bytes_toclient"))
         if bytes_like > RBF_BYTES_THRESHOLD:
             score += 0.2
             matched.append("high_bytes")
 
-        sig = (log.get("alert_signature") or log.get("alert_signature_id") or "").lower()
+        sig = str(log.get("alert_signature") or log.get("alert_signature_id") or "").lower()
         if "compression bomb" in sig or "compression" in sig:
             score += 0.6
             matched.append("high_risk_signature")
@@ -70,37 +85,137 @@ class PlannerAgent:
             score += 0.5
             matched.append("event_type:alert")
 
+        # --- Per-host window aggregates (agg_* fields from HostAggregator) ---
+        if _as_int(log.get("agg_src_flows")) > RBF_CONN_COUNT_THRESHOLD:
+            score += 0.3
+            matched.append("high_conn_rate")
+
+        if _as_int(log.get("agg_sig_alerts")) >= RBF_REPEAT_SIGNATURE_ALERTS:
+            score += 0.2
+            matched.append("repeated_signature")
+
+        conclusive = False
+        if _as_int(log.get("agg_src_ports")) >= RBF_SCAN_DISTINCT_PORTS:
+            score += 0.6
+            matched.append("port_scan")
+            conclusive = True
+
+        if (_as_int(flow_initiator(log)[1]) in _BRUTEFORCE_PORTS
+                and _as_int(log.get("agg_pair_flows")) >= RBF_BRUTEFORCE_FLOWS):
+            score += 0.6
+            matched.append("brute_force")
+            conclusive = True
+
         # --- Clamp score ---
         score = min(score, 1.0)
 
         # --- Verdict decision ---
         verdict = "benign"
-        if score >= SCORE_THRESHOLD_SUSPICIOUS:
+        # the aggregates describe the flow initiator; only block on them when that is src_ip
+        if conclusive and RBF_AGG_CONCLUSIVE and not _to_client(log):
+            verdict = "malicious"
+        elif score >= SCORE_THRESHOLD_SUSPICIOUS:
             verdict = "suspicious"
         elif score >= 0.3:
             verdict = "monitor"
 
         return {"score": score, "matched_rules": matched, "verdict": verdict}
 
-    def process_log(self, log: Dict[str, Any]) -> Dict[str, Any]:
-        trace = {"log_id": log.get("_id") or log.get("flow_id"), "planner": {}, "detection": None, "response": None}
-
-        # --- Run rule-based check ---
-        rbf = self.rule_based_check(log)
+    def plan(self, log: Dict[str, Any], rbf: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Rule stage. Returns the trace; trace["detection"] is None when the log
+        still needs the DetectionAgent, otherwise the trace is already final.
+        """
+        trace = {"log_id": log.get("_id") or log.get("flow_id"), "src_ip": log.get("src_ip"),
+                 "planner": {}, "detection": None, "response": None}
+
+        # --- Run rule-based check (on the log + its per-host window aggregates) ---
+        if rbf is None:
+            self.aggregator.observe(log)
+            rbf = self.rule_based_check(log)
         trace["planner"] = rbf
 
-        # Save intermediate state
+        # --- Aggregate rules that fired go on the log: the coalescing key and the verdict
+        #     cache fingerprint then change once a scan shows, instead of reusing an earlier verdict ---
+        host_rules = ",".join(r for r in rbf["matched_rules"] if r in _AGG_KEY_RULES)
+        if host_rules:
+            log["host_rules"] = host_rules
+
+        # Save intermediate state; later stages update this same entry
         self.state.add_trace(trace)
 
+        # --- Scan / brute force caught by the aggregate rules: no LLM call ---
+        if rbf["verdict"] == "malicious":
+            return self.complete(log, trace, {
+                "verdict": "malicious", "score": rbf["score"], "reasons": rbf["matched_rules"],
+                "recommended_action": "block_ip", "source": "rule_based",
+            })
+
         # --- Pass all suspicious OR Suricata alerts to DetectionAgent ---
         event_type = (log.get("event_type") or "").lower()
         if rbf["verdict"] == "benign" and event_type != "alert":
             trace["detection"] = {"verdict": "skipped", "reason": "rule_based_benign"}
+            self.state.update(trace)
             log_trace(trace)
             return trace
 
+        # --- Burst of identical alerts: only the leader goes to DetectionAgent ---
+        if self.coalescer is not None:
+            state, burst, fut = self.coalescer.join(log, trace)
+            if state == AlertCoalescer.MERGED:
+                self._finish_coalesced(trace, burst, burst.verdict)
+            elif state == AlertCoalescer.PARKED:
+                self._parked[id(trace)] = fut
+        return trace
+
+    def parked_future(self, trace: Dict[str, Any]):
+        """
+        Future resolving to the final trace if plan() parked this log behind a
+        burst leader still in detection; None otherwise.
+        """
+        return self._parked.pop(id(trace), None)
+
+    def _finish_coalesced(self, trace: Dict[str, Any], burst, verdict: Dict[str, Any]):
+        """Give a follower its leader's verdict; the response already fired for the leader."""
+        trace["detection"] = {k: v for k, v in verdict.items() if k != "llm_timing"}
+        trace["response"] = None
+        trace["coalesced"] = {"into": burst.leader_id, "merged": burst.merged}
+        log_trace(trace)
+        self.state.update(trace)
+
+    def _release_followers(self, trace: Dict[str, Any], verdict: Dict[str, Any]):
+        if self.coalescer is None:
+            return
+        burst, parked = self.coalescer.resolve(trace, verdict)
+        if burst is None:
+            return
+        if burst.merged:
+            trace["coalesced"] = {"into": burst.leader_id, "merged": burst.merged}
+        for _, follower, fut in parked:
+            self._finish_coalesced(follower, burst, verdict)
+            self._parked.pop(id(follower), None)
+            fut.set_result(follower)
+
+    def abandon(self, trace: Dict[str, Any]):
+        """Detection failed for an escalated trace; don't leave alerts parked behind it."""
+        self._release_followers(trace, {"verdict": "uncertain", "score": 0.5,
+                                        "reasons": ["coalesce_leader_failed"], "recommended_action": "monitor"})
+
+    def plan_many(self, logs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """plan() for a batch: one aggregator lock and one keyword regex pass for all logs."""
+        self.aggregator.observe_many(logs)
+        keywords = self.keyword_matcher.match_many(logs)
+        return [self.plan(log, self.rule_based_check(log, kws)) for log, kws in zip(logs, keywords)]
+
+    def complete(self, log: Dict[str, Any], trace: Dict[str, Any], detection_result: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Detection + response stage for a log escalated by plan()."""
         # --- If suspicious or alert, run DetectionAgent ---
-        detection_result = self.detector.analyze(log)
+        if detection_result is None:
+            try:
+                detection_result = self.detector.analyze(log)
+            except Exception:
+                self.abandon(trace)
+                raise
         trace["detection"] = detection_result
 
         # --- If malicious → trigger ResponseAgent ---
@@ -114,7 +229,10 @@ class PlannerAgent:
         else:
             trace["response"] = None
 
-        # --- Persist final trace ---
+        # --- Hand the verdict to alerts parked behind this one ---
+        self._release_followers(trace, detection_result)
+
+        # --- Persist final trace (the state store already holds it; re-index the verdict) ---
         log_trace(trace)
-        self.state.add_trace(trace)
+        self.state.update(trace)
         return trace
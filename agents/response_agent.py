@@ -1,25 +1,159 @@
 # agents/response_agent.py
+import threading
+import time
 from datetime import datetime
 from utils.db_logger import log_action
+from utils.config import RESPONSE_BLOCK_TTL, RESPONSE_APPLY_INTERVAL, RESPONSE_BATCH_MAX
+from utils.enforcement import EnforcementBackend, get_backend
+
+
+def _iso(ts: float) -> str:
+    return datetime.utcfromtimestamp(ts).isoformat() + "Z"
+
 
 class ResponseAgent:
-    def __init__(self):
+    """
+    Idempotent responder with a TTL index of (action, target) pairs.
+
+    A repeat of an action still in force is suppressed: no new record in
+    actions.log, nothing re-sent to enforcement. New block_ip targets are
+    queued and pushed to the enforcement backend in batches, every
+    apply_interval seconds or as soon as batch_max are pending.
+    """
+
+    def __init__(self, backend: EnforcementBackend = None, ttl: float = RESPONSE_BLOCK_TTL,
+                 apply_interval: float = RESPONSE_APPLY_INTERVAL, batch_max: int = RESPONSE_BATCH_MAX,
+                 verbose: bool = True):
         self.name = "ResponseAgent"
+        self.backend = backend or get_backend()
+        self.ttl = ttl
+        self.apply_interval = apply_interval
+        self.batch_max = batch_max
+        self.verbose = verbose
+
+        self._index = {}     # (action, target) -> expires_at (epoch)
+        self._pending = []   # block targets not yet pushed to the backend
+        self._batch = {"issued": 0, "suppressed": 0}
+        self.totals = {"issued": 0, "suppressed": 0, "applied": 0, "batches": 0}
+        self.last_batch = None
+        self._lock = threading.Lock()
+        self._apply_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="response-apply", daemon=True)
+        self._thread.start()
 
     def execute_action(self, log: dict, action_type: str = "block_ip", reason: str = "") -> dict:
         """
-        Simulate executing an action. Returns an action record.
+        Record an action (applied asynchronously for block_ip). Returns the action
+        record; status is "suppressed" when the same action on the same target is
+        still in force.
         """
         target = log.get("flow_src_ip") or log.get("source_ip") or log.get("gl2_remote_ip") or log.get("src_ip")
+        now = time.time()
+        key = (action_type, target)
         action = {
             "agent": self.name,
             "action": action_type,
             "target": target,
             "log_id": log.get("_id") or log.get("flow_id"),
             "reason": reason,
-            "time": datetime.utcnow().isoformat() + "Z",
-            "status": "simulated"
+            "time": _iso(now),
         }
+        with self._lock:
+            expires_at = self._index.get(key)
+            if expires_at is not None and expires_at > now:
+                self._batch["suppressed"] += 1
+                action.update(status="suppressed", expires_at=_iso(expires_at))
+                return action
+
+            self._index[key] = expires_at = now + self.ttl
+            self._batch["issued"] += 1
+            if action_type == "block_ip":
+                self._pending.append(target)
+                if len(self._pending) >= self.batch_max:
+                    self._wake.set()
+                action["status"] = "queued"
+            else:
+                action["status"] = "simulated"
+        action["expires_at"] = _iso(expires_at)
+
         # Persist to actions.log for demo / audit
         log_action(action)
         return action
+
+    def adopt(self, action: dict):
+        """
+        Take over an action record produced by another ResponseAgent (a shard
+        process, see core/sharding.py): index it and queue its enforcement
+        here. It is already in actions.log, so nothing is logged again.
+        """
+        now = time.time()
+        key = (action.get("action"), action.get("target"))
+        with self._lock:
+            if action.get("status") == "suppressed":
+                self._batch["suppressed"] += 1
+                return
+            expires_at = self._index.get(key)
+            if expires_at is not None and expires_at > now:
+                return  # same target already blocked via another shard
+            self._index[key] = now + self.ttl
+            self._batch["issued"] += 1
+            if key[0] == "block_ip":
+                self._pending.append(key[1])
+                if len(self._pending) >= self.batch_max:
+                    self._wake.set()
+
+    # -------------------------------
+    # Batched enforcement
+    # -------------------------------
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.apply_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> dict:
+        """Push pending block targets to the backend now. Returns the batch report (None if idle)."""
+        with self._apply_lock:
+            with self._lock:
+                now = time.time()
+                self._index = {k: e for k, e in self._index.items() if e > now}
+                new, self._pending = self._pending, []
+                batch, self._batch = self._batch, {"issued": 0, "suppressed": 0}
+                active = {t: e for (a, t), e in self._index.items() if a == "block_ip" and t}
+            if not (new or batch["issued"] or batch["suppressed"]):
+                return None
+
+            applied = 0
+            if new:
+                try:
+                    applied = self.backend.apply(active, new)
+                except Exception as e:
+                    print(f"ResponseAgent: {self.backend.name} apply failed, retrying next batch: {e}")
+                    with self._lock:
+                        self._pending[:0] = new
+
+            report = dict(batch, applied=applied, active=len(active), backend=self.backend.name)
+            for k in ("issued", "suppressed", "applied"):
+                self.totals[k] += report[k]
+            self.totals["batches"] += 1
+            self.last_batch = report
+        if self.verbose:
+            print(f"RESPONSE: issued {report['issued']} | suppressed {report['suppressed']} | "
+                  f"applied {report['applied']} ({report['backend']}) | active blocks {report['active']}")
+        return report
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = sum(1 for e in self._index.values() if e > time.time())
+        return dict(self.totals, active=active, last_batch=self.last_batch)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        self.backend.close()
@@ -0,0 +1,122 @@
+# core/coalesce.py
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+from utils.config import COALESCE_WINDOW_SECONDS, COALESCE_MAX_BURSTS
+
+
+class _Burst:
+    __slots__ = ("key", "leader_id", "started", "verdict", "parked", "merged")
+
+    def __init__(self, key, leader_id):
+        self.key = key
+        self.leader_id = leader_id
+        self.started = time.monotonic()
+        self.verdict = None   # leader's detection result once known
+        self.parked = []      # (log, trace, Future) waiting for that verdict
+        self.merged = 0       # followers folded into this burst so far
+
+
+class AlertCoalescer:
+    """
+    Collapses bursts of identical alerts, keyed by (src_ip, alert_signature_id,
+    host_rules): a host crossing a scan / brute-force threshold starts a new
+    burst, so its alerts get a fresh verdict.
+
+    The first alert of a burst leads and goes to detection. Alerts with the
+    same key arriving while the leader is in flight are parked and get its
+    verdict when it lands; later ones within `window` seconds of the leader
+    reuse the verdict straight away. Detection load is then bounded by
+    distinct incidents per window rather than by raw alert rate.
+    """
+
+    LEAD, PARKED, MERGED = "lead", "parked", "merged"
+
+    def __init__(self, window: float = COALESCE_WINDOW_SECONDS, max_bursts: int = COALESCE_MAX_BURSTS):
+        self.window = window
+        self.max_bursts = max_bursts
+        self._bursts = OrderedDict()  # key -> _Burst, oldest first
+        self._leaders = {}            # id(leader trace) -> _Burst
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key_of(log: Dict[str, Any]) -> Optional[Tuple[Any, Any, Any]]:
+        if (log.get("event_type") or "").lower() != "alert":
+            return None
+        src, sig = log.get("src_ip"), log.get("alert_signature_id") or log.get("alert_signature")
+        if not src or sig is None:
+            return None
+        return (src, sig, log.get("host_rules"))
+
+    def join(self, log: Dict[str, Any], trace: Dict[str, Any]) -> Tuple[str, Optional[_Burst], Optional[Future]]:
+        """
+        Register an escalated log. Returns (LEAD, burst, None), (PARKED, burst, future)
+        with the future resolving to the trace once the leader finishes, or
+        (MERGED, burst, None) when the leader's verdict is already known.
+        Logs without a coalescing key always lead (with burst None).
+        """
+        key = self.key_of(log)
+        if key is None:
+            return self.LEAD, None, None
+
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            burst = self._bursts.get(key)
+            if burst is None or (burst.verdict is not None and now - burst.started > self.window):
+                burst = _Burst(key, trace.get("log_id"))
+                self._bursts[key] = burst
+                self._bursts.move_to_end(key)
+                self._leaders[id(trace)] = burst
+                self.leaders += 1
+                return self.LEAD, burst, None
+
+            burst.merged += 1
+            self.coalesced += 1
+            if burst.verdict is not None:
+                return self.MERGED, burst, None
+            fut = Future()
+            burst.parked.append((log, trace, fut))
+            return self.PARKED, burst, fut
+
+    def resolve(self, trace: Dict[str, Any], verdict: Dict[str, Any]) -> Tuple[Optional[_Burst], List[tuple]]:
+        """
+        Leader `trace` got its verdict. Returns (burst, parked followers) for the
+        caller to finish; (None, []) if the trace didn't lead a burst.
+        Failed or deferred verdicts (LLM parse errors, load shedding) close the
+        burst so the next alert leads again.
+        """
+        with self._lock:
+            burst = self._leaders.pop(id(trace), None)
+            if burst is None:
+                return None, []
+            parked, burst.parked = burst.parked, []
+            if verdict.get("verdict") == "deferred" or "llm_parse_failed" in (verdict.get("reasons") or []):
+                if self._bursts.get(burst.key) is burst:
+                    del self._bursts[burst.key]
+            else:
+                burst.verdict = verdict
+            return burst, parked
+
+    def _evict(self, now: float):
+        while self._bursts:
+            burst = next(iter(self._bursts.values()))
+            if burst.verdict is None:
+                break  # leader still in flight; its followers are parked on it
+            if len(self._bursts) <= self.max_bursts and now - burst.started <= self.window:
+                break
+            self._bursts.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.leaders + self.coalesced
+            return {
+                "bursts": len(self._bursts),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "coalesced_rate": round(self.coalesced / total, 3) if total else 0.0,
+            }
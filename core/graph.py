@@ -1,17 +1,123 @@
 # core/graph.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 from agents.planner_agent import PlannerAgent
 from agents.detection_agent import DetectionAgent
 from agents.response_agent import ResponseAgent
+from core.scheduler import DetectionScheduler
+from utils.config import DETECTION_MAX_INFLIGHT, LLM_WARMUP, SCHED_ENABLED, GRAPH_PIPELINE_DEPTH
+from utils.batching import pipelined
+from utils.llm_client import get_client, LLMPool
+from utils import db_logger
 
 class AgentGraph:
-    def __init__(self):
-        self.detector = DetectionAgent()
-        self.responder = ResponseAgent()
+    def __init__(self, max_inflight: int = DETECTION_MAX_INFLIGHT, warmup: bool = LLM_WARMUP,
+                 scheduled: bool = SCHED_ENABLED, responder: ResponseAgent = None,
+                 pipeline_depth: int = GRAPH_PIPELINE_DEPTH):
+        self.llm = get_client()
+        self.detector = DetectionAgent(llm_client=self.llm)
+        self.responder = responder or ResponseAgent()
         self.planner = PlannerAgent(self.detector, self.responder)
 
-    def process_many(self, logs: List[Dict]) -> List[Dict]:
-        results = []
-        for l in logs:
-            results.append(self.planner.process_log(l))
-        return results
\ No newline at end of file
+        # Escalated logs go through a priority scheduler (max_inflight worker
+        # threads) that sheds the lowest-priority ones under load. Without it,
+        # each batch's escalated logs go to one analyze_many call on a bounded pool.
+        self.max_inflight = max(1, int(max_inflight or 1))
+        self.scheduler = DetectionScheduler(self.detector, self.planner, workers=self.max_inflight) if scheduled else None
+        self.pipeline_depth = max(1, pipeline_depth) if self.scheduler is not None else 1
+        self._pool = None
+        if self.scheduler is None and self.max_inflight > 1:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_inflight, thread_name_prefix="detection")
+
+        # Load the model in the background so startup isn't blocked but the
+        # first escalated log doesn't pay the cold-load either.
+        self.warmup_result = None
+        if warmup:
+            threading.Thread(target=self._warmup, name="llm-warmup", daemon=True).start()
+
+    def _warmup(self):
+        self.warmup_result = self.llm.warmup()
+
+    def process_many(self, logs: List[Dict], concurrent: bool = True) -> List[Dict]:
+        """
+        Process a batch; results come back in input order. Escalated logs go
+        through the scheduler (highest priority first, in multi-log prompts),
+        or without it through one DetectionAgent.analyze_many call.
+        """
+        return self.result(self.submit(logs, concurrent))
+
+    def submit(self, logs: List[Dict], concurrent: bool = True) -> tuple:
+        """
+        Plan a batch and queue its escalated logs on the scheduler without
+        waiting for them; returns the ticket for result() / done(). Without
+        the scheduler detection runs here and the ticket is already done.
+        """
+        traces = self.planner.plan_many(logs)
+        parked, escalated = [], []
+        for i, t in enumerate(traces):
+            fut = self.planner.parked_future(t)
+            if fut is not None:
+                parked.append(fut)  # finished by its burst leader, not sent to detection
+            elif t["detection"] is None:
+                escalated.append(i)
+
+        futures = []
+        if escalated and concurrent and self.scheduler is not None:
+            futures = [(i, self.scheduler.submit(logs[i], traces[i])) for i in escalated]
+        elif escalated:
+            executor = self._pool if concurrent else None
+            try:
+                verdicts = self.detector.analyze_many([logs[i] for i in escalated], executor=executor)
+            except Exception:
+                for i in escalated:
+                    self.planner.abandon(traces[i])
+                raise
+            for i, verdict in zip(escalated, verdicts):
+                traces[i] = self.planner.complete(logs[i], traces[i], verdict)
+        return traces, futures, parked
+
+    def result(self, ticket: tuple) -> List[Dict]:
+        """Wait for a submitted batch; its traces in input order."""
+        traces, futures, parked = ticket
+        for i, fut in futures:
+            traces[i] = fut.result()
+        for fut in parked:
+            fut.result()  # finished by a leader in this or an earlier batch
+        return traces
+
+    @staticmethod
+    def done(ticket: tuple) -> bool:
+        _, futures, parked = ticket
+        return all(f.done() for _, f in futures) and all(f.done() for f in parked)
+
+    def pipeline(self, batches, logs_of=None):
+        """
+        utils.batching.pipelined, pipeline_depth batches deep: planning the
+        next batches while earlier ones are in detection keeps the scheduler
+        queue spanning several micro-batches, so its priority order and load
+        shedding work on the backlog rather than on one batch at a time.
+        """
+        return pipelined(self.submit, self.result, self.done, batches, self.pipeline_depth, logs_of)
+
+    def stats(self) -> Dict:
+        stats = {"verdict_cache": self.detector.cache_stats()}
+        if self.detector.prefilter is not None:
+            stats["prefilter"] = self.detector.prefilter_stats()
+        if self.planner.coalescer is not None:
+            stats["coalescing"] = self.planner.coalescer.stats()
+        if self.scheduler is not None:
+            stats["scheduler"] = self.scheduler.stats()
+        if isinstance(self.llm, LLMPool):
+            stats["llm"] = self.llm.stats()
+        stats["response"] = self.responder.stats()
+        stats["state"] = {"traces": len(self.planner.state), "verdicts": self.planner.state.verdict_counts()}
+        return stats
+
+    def close(self):
+        if self.scheduler is not None:
+            self.scheduler.close()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        self.responder.close()  # push the last pending blocks
+        db_logger.flush()
@@ -0,0 +1,218 @@
+# core/scheduler.py
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+from utils.config import (
+    DETECTION_BATCH_MAX, SCHED_MAX_DEPTH, SCHED_MAX_WAIT, SCHED_LATENCY_LEVEL, SCHED_PRESSURE_DEPTH,
+    SCHED_SEVERITY_WEIGHT, SCHED_AGE_WEIGHT
+)
+
+
+class _Item:
+    __slots__ = ("key", "seq", "log", "trace", "future", "enqueued")
+
+    def __init__(self, key, seq, log, trace, enqueued):
+        self.key = key
+        self.seq = seq
+        self.log = log
+        self.trace = trace
+        self.future = Future()
+        self.enqueued = enqueued
+
+    def __lt__(self, other):
+        return (self.key, self.seq) < (other.key, other.seq)
+
+
+def _severity(log: Dict[str, Any]) -> Optional[int]:
+    try:
+        sev = int(log.get("alert_severity"))
+    except (TypeError, ValueError):
+        return None
+    return sev if 1 <= sev <= 3 else None
+
+
+class DetectionScheduler:
+    """
+    Bounded priority queue between the planner and DetectionAgent, drained by
+    `workers` threads that each take up to batch_max items per analyze_many call.
+
+    priority = planner score + severity bonus (Suricata severity 1 highest)
+               + age_weight * seconds waited
+    The age term grows at the same rate for every item, so the heap key is
+    fixed at enqueue time: -(base - age_weight * enqueued).
+
+    Load shedding completes the lowest-priority items with a rule-only
+    {"verdict": "deferred"} detection instead of analyzing them:
+    - "depth":   the queue is over max_depth
+    - "latency": detection calls (EWMA) are slower than latency_level; the
+                 queue is trimmed to pressure_depth
+    - "stale":   an item waited longer than max_wait
+    """
+
+    def __init__(self, detector, planner, workers: int = 1, batch_max: int = DETECTION_BATCH_MAX,
+                 max_depth: int = SCHED_MAX_DEPTH, max_wait: float = SCHED_MAX_WAIT,
+                 latency_level: float = SCHED_LATENCY_LEVEL, pressure_depth: int = SCHED_PRESSURE_DEPTH,
+                 severity_weight: float = SCHED_SEVERITY_WEIGHT, age_weight: float = SCHED_AGE_WEIGHT):
+        self.detector = detector
+        self.planner = planner
+        self.batch_max = max(1, batch_max)
+        self.max_depth = max_depth
+        self.max_wait = max_wait
+        self.latency_level = latency_level
+        self.pressure_depth = pressure_depth
+        self.severity_weight = severity_weight
+        self.age_weight = age_weight
+
+        self._heap: List[_Item] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._inflight = 0
+        self._latency_ewma = None          # seconds per analyze_many call
+        self._waits = deque(maxlen=2048)   # recent queue waits (ms) of analyzed items
+        self.submitted = 0
+        self.analyzed = 0
+        self.shed = {"depth": 0, "latency": 0, "stale": 0}
+
+        self._threads = [threading.Thread(target=self._worker, name=f"detection-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    # -------------------------------
+    # Producer side
+    # -------------------------------
+    def priority(self, log: Dict[str, Any], trace: Dict[str, Any]) -> float:
+        base = float((trace.get("planner") or {}).get("score") or 0.0)
+        sev = _severity(log)
+        if sev is not None:
+            base += self.severity_weight * (3 - sev) / 2
+        return base
+
+    def submit(self, log: Dict[str, Any], trace: Dict[str, Any]) -> Future:
+        """Queue an escalated log; the Future resolves to its final trace (possibly deferred)."""
+        now = time.monotonic()
+        item = _Item(-(self.priority(log, trace) - self.age_weight * now), next(self._seq), log, trace, now)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("DetectionScheduler is closed")
+            heapq.heappush(self._heap, item)
+            self.submitted += 1
+            shed = self._trim()
+            self._cond.notify()
+        self._defer(shed)
+        return item.future
+
+    def _trim(self) -> List[tuple]:
+        """Lowest-priority items over the depth limits (called with the lock held)."""
+        limit, reason = self.max_depth, "depth"
+        if self._latency_ewma is not None and self._latency_ewma > self.latency_level:
+            limit, reason = min(limit, self.pressure_depth), "latency"
+        shed = []
+        if len(self._heap) > limit:
+            self._heap.sort()
+            while len(self._heap) > limit:
+                shed.append((self._heap.pop(), reason))  # largest key = lowest priority
+                self.shed[reason] += 1
+        return shed
+
+    def _defer(self, shed: List[tuple]):
+        """Complete shed items as deferred (counted in self.shed by _trim / _take, under the lock)."""
+        for item, reason in shed:
+            verdict = {"verdict": "deferred", "reason": f"load_shed:{reason}",
+                       "queue_wait_ms": round((time.monotonic() - item.enqueued) * 1000, 1)}
+            self._finish(item, verdict)
+
+    def _finish(self, item: _Item, verdict: Dict[str, Any]):
+        try:
+            item.future.set_result(self.planner.complete(item.log, item.trace, verdict))
+        except Exception as e:
+            item.future.set_exception(e)
+
+    # -------------------------------
+    # Workers
+    # -------------------------------
+    def _take(self):
+        """Up to batch_max highest-priority items plus any stale ones to defer; None once closed and drained."""
+        with self._cond:
+            while not self._heap and not self._closed:
+                self._cond.wait()
+            if not self._heap:
+                return None
+            now = time.monotonic()
+            batch, stale = [], []
+            while self._heap and len(batch) < self.batch_max:
+                item = heapq.heappop(self._heap)
+                if now - item.enqueued > self.max_wait:
+                    stale.append((item, "stale"))
+                    self.shed["stale"] += 1
+                else:
+                    batch.append(item)
+            self._inflight += len(batch)
+            return batch, stale
+
+    def _worker(self):
+        while True:
+            taken = self._take()
+            if taken is None:
+                return
+            batch, stale = taken
+            self._defer(stale)
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            try:
+                verdicts = self.detector.analyze_many([item.log for item in batch])
+            except Exception as e:
+                for item in batch:
+                    self.planner.abandon(item.trace)
+                    item.future.set_exception(e)
+                verdicts = None
+            elapsed = time.monotonic() - started
+
+            with self._cond:
+                self._inflight -= len(batch)
+                self._latency_ewma = elapsed if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * elapsed
+                if verdicts is not None:
+                    self.analyzed += len(batch)
+                    for item in batch:
+                        self._waits.append((started - item.enqueued) * 1000)
+                shed = self._trim()
+            self._defer(shed)
+
+            for item, verdict in zip(batch, verdicts or []):
+                verdict["queue_wait_ms"] = round((started - item.enqueued) * 1000, 1)
+                self._finish(item, verdict)
+
+    # -------------------------------
+    # Introspection / shutdown
+    # -------------------------------
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            waits = sorted(self._waits)
+            latency = self._latency_ewma
+            stats = {
+                "depth": len(self._heap),
+                "max_depth": self.max_depth,
+                "inflight": self._inflight,
+                "submitted": self.submitted,
+                "analyzed": self.analyzed,
+                "shed": dict(self.shed),
+                "detect_latency_ewma_ms": None if latency is None else round(latency * 1000, 1),
+            }
+        for p in (50, 95, 99):
+            stats[f"wait_p{p}_ms"] = round(waits[min(len(waits) - 1, len(waits) * p // 100)], 1) if waits else None
+        return stats
+
+    def close(self):
+        """Stop accepting work, let the workers drain the queue, and wait for them."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join()
@@ -0,0 +1,285 @@
+# core/sharding.py
+import json
+import multiprocessing as mp
+import queue
+import signal
+import threading
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+from utils.config import DETECTION_MAX_INFLIGHT, LLM_WARMUP, SHARD_QUEUE_SIZE, SHARD_POLL_INTERVAL
+from utils.events import event_json
+from utils.host_stats import flow_initiator
+from utils.batching import pipelined
+from utils import db_logger
+
+
+def shard_of(log: Dict[str, Any], shards: int) -> int:
+    """
+    Stable shard for a log's flow initiator (crc32, so every process agrees):
+    the host aggregates are keyed on it, so both directions of a client's
+    flows must land in the same shard.
+    """
+    src = flow_initiator(log)[0]
+    return zlib.crc32(str(src).encode()) % shards if src else 0
+
+
+class _Recorder:
+    """
+    Stands in for the TraceWriter inside a shard: log_trace / log_action
+    records are kept and shipped to the parent with the batch results,
+    already JSON-encoded so the parent only has to write them.
+    """
+
+    def __init__(self):
+        self._records = []
+        self._lock = threading.Lock()
+
+    def write(self, filename: str, obj: dict):
+        with self._lock:
+            self._records.append((filename, obj))
+
+    def drain(self, traces: List[dict] = ()) -> Tuple[list, List[tuple]]:
+        """
+        (refs, [(filename, json line)]). Each trace in `traces` is sent once:
+        as the index of its record when it was logged (the parent decodes that
+        line), as itself otherwise.
+        """
+        with self._lock:
+            records, self._records = self._records, []
+        where = {id(obj): i for i, (_, obj) in enumerate(records)}
+        refs = [where.get(id(t), t) for t in traces]
+        return refs, [(filename, event_json(obj)) for filename, obj in records]
+
+    def flush(self, timeout: float = None) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+
+def _shard_main(shard: int, inbox, outbox, max_inflight: int, warmup: bool):
+    """Worker process: its own AgentGraph (planner, host aggregates, coalescer, cache) for one slice of src_ips."""
+    from core.graph import AgentGraph
+    from agents.response_agent import ResponseAgent
+    from utils.enforcement import EnforcementBackend
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is handled by the parent, which stops the shards
+    recorder = _Recorder()
+    db_logger.use_writer(recorder)
+    # TTL index / suppression stay per shard; the parent does the enforcement
+    g = AgentGraph(max_inflight=max_inflight, warmup=warmup,
+                   responder=ResponseAgent(backend=EnforcementBackend(), verbose=False))
+    try:
+        while True:
+            msg = inbox.get()
+            kind, seq = msg[0], msg[1]
+            if kind == "stop":
+                break
+            try:
+                if kind == "batch":
+                    refs, records = recorder.drain(g.process_many(msg[2]))
+                    outbox.put(("done", shard, seq, refs, records))
+                elif kind == "stats":
+                    outbox.put(("stats", shard, seq, g.stats(), None))
+            except Exception as e:
+                outbox.put(("error", shard, seq, f"{type(e).__name__}: {e}", recorder.drain()[1]))
+    finally:
+        g.close()
+        outbox.put(("closed", shard, None, None, recorder.drain()[1]))
+
+
+class ShardedGraph:
+    """
+    Runs N AgentGraphs in worker processes, partitioned by crc32(src_ip), so
+    rule evaluation, per-host aggregates, coalescing and JSON encoding use N
+    cores. All state keyed by host stays inside one shard.
+
+    The parent does ingest, writes every shard's traces / actions through its
+    own TraceWriter (so traces.log, actions.log and the trace store keep a
+    single writer) and owns enforcement: block actions decided in the shards
+    are adopted by the parent's ResponseAgent.
+
+    process_many() waits for its batch; submit() / result() and pipeline()
+    keep up to queue_size batches in flight so the shards don't idle while
+    the parent collects a reply and reads the next batch.
+    """
+
+    def __init__(self, shards: int, max_inflight: int = DETECTION_MAX_INFLIGHT, warmup: bool = LLM_WARMUP,
+                 queue_size: int = SHARD_QUEUE_SIZE, poll_interval: float = SHARD_POLL_INTERVAL):
+        from agents.response_agent import ResponseAgent
+
+        if shards < 2:
+            raise ValueError("ShardedGraph needs at least 2 shards; use AgentGraph otherwise")
+        self.shards = shards
+        # detection concurrency is split across shards, not multiplied by them
+        self.per_shard_inflight = max(1, -(-int(max_inflight or 1) // shards))
+        self.max_inflight = self.per_shard_inflight * shards
+        self.queue_size = max(1, queue_size)
+        self.poll_interval = poll_interval
+        self.responder = ResponseAgent()
+        self.writer = db_logger.get_writer()
+
+        ctx = mp.get_context("spawn")  # the parent has writer / response threads running; don't fork them
+        self._outbox = ctx.Queue()
+        self._inboxes = [ctx.Queue(maxsize=self.queue_size) for _ in range(shards)]
+        self._procs = [ctx.Process(target=_shard_main, name=f"shard-{i}", daemon=True,
+                                   args=(i, self._inboxes[i], self._outbox, self.per_shard_inflight, warmup))
+                       for i in range(shards)]
+        for p in self._procs:
+            p.start()
+        self._seq = 0
+        self._calls = {}  # seq -> {"sent": {shard: [log indexes]}, "replies": {shard: (kind, payload)}, ...}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    # -------------------------------
+    # Batches
+    # -------------------------------
+    def process_many(self, logs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """AgentGraph.process_many across the shards; results in input order."""
+        return self.result(self.submit(logs))
+
+    def submit(self, logs: List[Dict[str, Any]]) -> int:
+        """
+        Send a batch to its shards without waiting for it; returns the ticket
+        for result(). Blocks while a shard already has queue_size batches queued.
+        """
+        parts = [[] for _ in range(self.shards)]
+        for i, log in enumerate(logs):
+            parts[shard_of(log, self.shards)].append(i)
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            sent = {shard: idx for shard, idx in enumerate(parts) if idx}
+            self._calls[seq] = {"n": len(logs), "sent": sent, "replies": {}}
+            for shard, idx in sent.items():
+                self._put(shard, ("batch", seq, [logs[i] for i in idx]))
+        return seq
+
+    def result(self, seq: int) -> List[Dict[str, Any]]:
+        """Wait for a submitted batch; its traces in input order."""
+        call = self._wait(seq)
+        results = [None] * call["n"]
+        errors = []
+        for shard, idx in call["sent"].items():
+            kind, payload = call["replies"][shard]
+            if kind == "error":
+                errors.append(f"shard {shard}: {payload}")
+                continue
+            for i, trace in zip(idx, payload):
+                results[i] = trace
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        return results
+
+    def done(self, seq: int) -> bool:
+        """True once every shard has answered a submitted batch (collects replies that already arrived)."""
+        with self._lock:
+            while self._receive(timeout=0):
+                pass
+            call = self._calls[seq]
+            return len(call["replies"]) == len(call["sent"])
+
+    def pipeline(self, batches: Iterable[list], logs_of: Callable[[list], List[Dict[str, Any]]] = None
+                 ) -> Iterator[Tuple[list, List[Dict[str, Any]], float]]:
+        """utils.batching.pipelined over the shards, queue_size batches deep."""
+        return pipelined(self.submit, self.result, self.done, batches, self.queue_size, logs_of)
+
+    def _put(self, shard: int, msg: tuple):
+        while True:
+            try:
+                self._inboxes[shard].put(msg, timeout=self.poll_interval)
+                return
+            except queue.Full:
+                if not self._procs[shard].is_alive():
+                    raise RuntimeError(f"shard process exited: {self._procs[shard].name}") from None
+                self._receive(timeout=0)  # keep writing records while the shard works through its queue
+
+    def _wait(self, seq: int) -> Dict[str, Any]:
+        while True:
+            with self._lock:
+                call = self._calls[seq]
+                if len(call["replies"]) == len(call["sent"]):
+                    del self._calls[seq]
+                    return call
+                self._receive(timeout=self.poll_interval)
+
+    def _receive(self, timeout: float) -> bool:
+        """Take one reply off the outbox (caller holds _lock); False if none came within timeout."""
+        try:
+            kind, shard, seq, payload, records = self._outbox.get(timeout=timeout)
+        except queue.Empty:
+            dead = [p.name for p in self._procs if not p.is_alive()]
+            if dead:
+                raise RuntimeError(f"shard process exited: {', '.join(dead)}") from None
+            return False  # shards are alive, just slow (detection in progress)
+        if kind == "closed":
+            self._merge(records)
+            raise RuntimeError(f"shard {shard} stopped")
+        if kind == "done":
+            payload = self._traces(payload, records)
+        else:
+            self._merge(records)
+        call = self._calls.get(seq)
+        if call is not None:
+            call["replies"][shard] = (kind, payload)
+        return True  # a reply for an unknown seq belonged to a call that already failed
+
+    def _traces(self, refs: list, records: List[tuple]) -> List[Dict[str, Any]]:
+        """Write a batch's records and resolve its traces (record indexes decode the logged line)."""
+        decoded = self._merge(records, {r for r in refs if isinstance(r, int)})
+        traces = [decoded[r] if isinstance(r, int) else r for r in refs]
+        for trace in traces:
+            if trace.get("response"):
+                self.responder.adopt(trace["response"])
+        return traces
+
+    def _merge(self, records, wanted=frozenset()) -> Dict[int, dict]:
+        """Write shard records through the parent's writer; returns {index: obj} for `wanted` and sink records."""
+        sinks = getattr(self.writer, "sinks", None) or ()
+        decoded = {}
+        for i, (filename, line) in enumerate(records or ()):
+            obj = None
+            if i in wanted or filename in sinks:
+                obj = decoded[i] = json.loads(line)
+            self.writer.write_encoded(filename, obj, line)
+        return decoded
+
+    # -------------------------------
+    # Introspection / shutdown
+    # -------------------------------
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._calls[seq] = {"sent": dict.fromkeys(range(self.shards)), "replies": {}}
+            for shard in range(self.shards):
+                self._put(shard, ("stats", seq))
+        replies = self._wait(seq)["replies"]
+        return {"shards": [replies[i][1] for i in range(self.shards)], "response": self.responder.stats()}
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        with self._lock:
+            for inbox in self._inboxes:
+                inbox.put(("stop", None))
+            pending = self.shards
+            while pending:
+                try:
+                    kind, _, _, payload, records = self._outbox.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    if not any(p.is_alive() for p in self._procs):
+                        break
+                    continue
+                if kind == "done":
+                    self._traces(payload, records)  # batches submitted but never collected
+                else:
+                    self._merge(records)
+                if kind == "closed":
+                    pending -= 1
+        for p in self._procs:
+            p.join(timeout=5)
+        self.responder.close()
+        db_logger.flush()
@@ -1,13 +1,130 @@
 # core/state.py
-from collections import deque
-from typing import Dict, Any
+import threading
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Dict, List, Optional
+
+
+def verdict_of(trace: Dict[str, Any]) -> str:
+    """Detection verdict, "pending" while the trace still waits for detection."""
+    detection = trace.get("detection")
+    if detection is None:
+        return "pending"
+    return (detection.get("verdict") or "unknown").lower()
+
 
 class StateStore:
+    """
+    Ring of the most recent traces, each held once and updated in place as
+    the pipeline stages finish, with indexes by log_id, src_ip and verdict
+    that are evicted together with the ring.
+    """
+
     def __init__(self, maxlen=1000):
-        self._traces = deque(maxlen=maxlen)  # recent traces
+        self.maxlen = maxlen
+        self._ring = OrderedDict()  # seq -> [trace, log_id, src_ip, verdict], oldest first
+        self._seq_of = {}           # id(trace) -> seq (ids stay valid while the ring holds the trace)
+        self._by_log_id = {}        # log_id -> seq of the newest trace for it
+        self._by_src = {}           # src_ip -> {seq: None}, insertion ordered
+        self._by_verdict = {}       # verdict -> {seq: None}
+        self._next_seq = 0
+        self._lock = threading.Lock()
 
+    # -------------------------------
+    # Writes
+    # -------------------------------
     def add_trace(self, trace: Dict[str, Any]):
-        self._traces.appendleft(trace)
+        """Hold a new trace; for one already held this only refreshes its indexes."""
+        with self._lock:
+            self._upsert(trace)
+
+    def update(self, trace: Dict[str, Any]):
+        """Re-index a trace a later stage changed in place (re-added as newest if it was evicted meanwhile)."""
+        with self._lock:
+            self._upsert(trace)
+
+    def _upsert(self, trace: Dict[str, Any]):
+        seq = self._seq_of.get(id(trace))
+        if seq is not None:
+            entry = self._ring[seq]
+            verdict = verdict_of(trace)
+            if verdict != entry[3]:
+                self._unindex(self._by_verdict, entry[3], seq)
+                self._by_verdict.setdefault(verdict, {})[seq] = None
+                entry[3] = verdict
+            return
+
+        seq = self._next_seq
+        self._next_seq += 1
+        log_id, src_ip, verdict = trace.get("log_id"), trace.get("src_ip"), verdict_of(trace)
+        self._ring[seq] = [trace, log_id, src_ip, verdict]
+        self._seq_of[id(trace)] = seq
+        if log_id is not None:
+            self._by_log_id[log_id] = seq
+        if src_ip:
+            self._by_src.setdefault(src_ip, {})[seq] = None
+        self._by_verdict.setdefault(verdict, {})[seq] = None
+
+        while len(self._ring) > self.maxlen:
+            self._evict_oldest()
+
+    def _evict_oldest(self):
+        seq, (trace, log_id, src_ip, verdict) = self._ring.popitem(last=False)
+        del self._seq_of[id(trace)]
+        if log_id is not None and self._by_log_id.get(log_id) == seq:
+            del self._by_log_id[log_id]
+        if src_ip:
+            self._unindex(self._by_src, src_ip, seq)
+        self._unindex(self._by_verdict, verdict, seq)
+
+    @staticmethod
+    def _unindex(index: Dict[Any, Dict[int, None]], key, seq: int):
+        seqs = index.get(key)
+        if seqs is not None:
+            seqs.pop(seq, None)
+            if not seqs:
+                del index[key]
+
+    # -------------------------------
+    # Reads
+    # -------------------------------
+    def recent(self, n=50) -> List[Dict[str, Any]]:
+        """Newest n traces, newest first, without copying the whole ring."""
+        with self._lock:
+            return [entry[0] for entry in islice(reversed(self._ring.values()), n)]
+
+    def get(self, log_id) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            seq = self._by_log_id.get(log_id)
+            return None if seq is None else self._ring[seq][0]
+
+    def for_host(self, src_ip: str, n: int = None) -> List[Dict[str, Any]]:
+        """Traces held for src_ip, newest first."""
+        with self._lock:
+            seqs = self._by_src.get(src_ip) or {}
+            return [self._ring[s][0] for s in islice(reversed(seqs), n)]
+
+    def seen_host(self, src_ip: str) -> bool:
+        with self._lock:
+            return src_ip in self._by_src
+
+    def seen_log(self, log_id) -> bool:
+        with self._lock:
+            return log_id in self._by_log_id
+
+    def with_verdict(self, verdict: str, n: int = None) -> List[Dict[str, Any]]:
+        """Traces whose detection verdict is `verdict`, most recently (re)indexed first."""
+        with self._lock:
+            seqs = self._by_verdict.get(verdict) or {}
+            return [self._ring[s][0] for s in islice(reversed(seqs), n)]
+
+    def count(self, verdict: str) -> int:
+        with self._lock:
+            return len(self._by_verdict.get(verdict) or ())
+
+    def verdict_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {v: len(seqs) for v, seqs in self._by_verdict.items()}
 
-    def recent(self, n=50):
-        return list(self._traces)[:n]
+    def __len__(self):
+        return len(self._ring)
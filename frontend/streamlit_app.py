@@ -1,25 +1,33 @@
 import streamlit as st
-import json
 import os
-import time
+from collections import Counter, deque
 from datetime import datetime, timezone
-from core.graph import AgentGraph
+from utils.config import (
+    DASHBOARD_MAX_RESULTS, DASHBOARD_PAGE_SIZE, DASHBOARD_REFRESH_SECONDS,
+    DASHBOARD_BUCKET_SECONDS, DASHBOARD_BUCKETS, TRACE_DB_PATH
+)
+from utils.trace_store import TraceStore, to_epoch
 
-TRACE_LOG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data", "traces.log"))
+SINCE_ID_PAGE = 1000  # rows per since_id query while catching up
 
 st.set_page_config(page_title="Agentic NDR Dashboard", layout="wide")
 
 # -------------------------------
 # Init session state
 # -------------------------------
-if "graph" not in st.session_state:
-    st.session_state.graph = AgentGraph()
 if "results" not in st.session_state:
-    st.session_state.results = []
-if "last_pos" not in st.session_state:
-    st.session_state.last_pos = 0  # pointer for reading file incrementally
+    st.session_state.results = deque(maxlen=DASHBOARD_MAX_RESULTS)  # ring buffer, newest last
+if "last_row_id" not in st.session_state:
+    st.session_state.last_row_id = None  # pointer for reading the trace store incrementally (None: not seeded)
+if "totals" not in st.session_state:
+    st.session_state.totals = Counter()   # running counts since the page opened
+if "buckets" not in st.session_state:
+    st.session_state.buckets = {}         # bucket start (epoch) -> Counter of detection verdicts
+
 
-graph = st.session_state.graph
+@st.cache_resource
+def store() -> TraceStore:
+    return TraceStore(TRACE_DB_PATH)
 
 # -------------------------------
 # Header
@@ -35,32 +43,37 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-placeholder = st.empty()
-
 # -------------------------------
-# Helper to read new lines
+# Helper to read new traces
 # -------------------------------
+def seed_recent():
+    """
+    On first load show the newest DASHBOARD_MAX_RESULTS traces and start
+    reading after them, instead of replaying the whole store from row 0.
+    They fill the feed but not the "since the page opened" totals.
+    """
+    if st.session_state.last_row_id is not None or not os.path.exists(TRACE_DB_PATH):
+        return
+    recent = store().recent(DASHBOARD_MAX_RESULTS)[::-1]  # oldest first
+    for r in recent:
+        r["log_id"] = r.get("log_id") or f"unknown-{r.get('_row_id')}"
+        st.session_state.results.append(r)
+    st.session_state.last_row_id = recent[-1]["_row_id"] if recent else 0
+
+
 def read_new_lines():
-    path = TRACE_LOG_PATH
-    if not os.path.exists(path):
+    """New traces since the last call, read from the SQLite trace store by row id until caught up."""
+    if not os.path.exists(TRACE_DB_PATH):
         return []
 
     new_entries = []
-    with open(path, "r", encoding="utf-8") as f:
-        f.seek(st.session_state.last_pos)
-        lines = f.readlines()
-        st.session_state.last_pos = f.tell()
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            new_entries.append(json.loads(line))
-        except json.JSONDecodeError:
-            continue
-
-    return new_entries
+    while True:
+        page = store().since_id(st.session_state.last_row_id or 0, limit=SINCE_ID_PAGE)
+        if page:
+            st.session_state.last_row_id = page[-1]["_row_id"]
+            new_entries.extend(page)
+        if len(page) < SINCE_ID_PAGE:
+            return new_entries
 
 
 # -------------------------------
@@ -93,81 +106,163 @@ def combined_icon(planner_verdict: str, detection_verdict: str) -> str:
 
 
 # -------------------------------
-# Rendering function
+# Incremental aggregates
+# -------------------------------
+def verdicts_of(r: dict):
+    planner = r.get("planner") or {}
+    detection = r.get("detection") or {}
+    return (planner.get("verdict") or "unknown").lower(), (detection.get("verdict") or "unknown").lower()
+
+
+def ingest(new_entries):
+    """Add new traces to the ring buffer and fold them into the running totals / buckets."""
+    totals = st.session_state.totals
+    buckets = st.session_state.buckets
+    for r in new_entries:
+        r["log_id"] = r.get("log_id") or f"unknown-{r.get('_row_id')}"
+        planner_verdict, detection_verdict = verdicts_of(r)
+        totals["traces"] += 1
+        totals[f"planner:{planner_verdict}"] += 1
+        totals[f"detection:{detection_verdict}"] += 1
+        if r.get("response"):
+            totals["actions"] += 1
+
+        bucket = int(to_epoch(r.get("logged_at")) // DASHBOARD_BUCKET_SECONDS) * DASHBOARD_BUCKET_SECONDS
+        buckets.setdefault(bucket, Counter())[detection_verdict] += 1
+        st.session_state.results.append(r)
+
+    # keep only the newest DASHBOARD_BUCKETS buckets
+    for old in sorted(buckets)[:-DASHBOARD_BUCKETS]:
+        del buckets[old]
+
+
+# -------------------------------
+# Rendering
 # -------------------------------
-def render_dashboard():
-    """Re-render dashboard cleanly inside the placeholder"""
-    with placeholder.container():  
-        results = st.session_state.results
+def render_summary():
+    totals = st.session_state.totals
+    cols = st.columns(5)
+    cols[0].metric("Traces", totals["traces"])
+    cols[1].metric("Malicious", totals["detection:malicious"])
+    cols[2].metric("Suspicious (planner)", totals["planner:suspicious"])
+    cols[3].metric("Skipped (rule benign)", totals["detection:skipped"])
+    cols[4].metric("Actions", totals["actions"])
+
+    buckets = st.session_state.buckets
+    if buckets:
+        verdicts = sorted({v for c in buckets.values() for v in c})
+        rows = {
+            datetime.fromtimestamp(b, tz=timezone.utc).strftime("%H:%M"): {v: buckets[b].get(v, 0) for v in verdicts}
+            for b in sorted(buckets)
+        }
+        st.bar_chart(rows_to_columns(rows, verdicts))
 
-        if not results:
-            st.info("Waiting for logs to arrive...")
-            return
 
-        st.markdown(
-            f"<p style='font-size:14px; color:gray;'>Showing last {min(50, len(results))} entries</p>",
-            unsafe_allow_html=True
-        )
+def rows_to_columns(rows: dict, verdicts: list) -> dict:
+    """{label: {verdict: n}} -> {verdict: {label: n}} for st.bar_chart."""
+    return {v: {label: counts[v] for label, counts in rows.items()} for v in verdicts}
 
-        for r in reversed(results[-500:]):  
-            planner = r.get("planner", {})
-            detection = r.get("detection", {})
-            response = r.get("response", {})
 
-            planner_verdict = planner.get("verdict", "unknown").lower()
-            detection_verdict = detection.get("verdict", "unknown").lower()
+def filtered_results(detection_filter, planner_filter, ip_filter):
+    ip_filter = ip_filter.strip()
+    out = []
+    for r in reversed(st.session_state.results):  # newest first
+        planner_verdict, detection_verdict = verdicts_of(r)
+        if detection_filter and detection_verdict not in detection_filter:
+            continue
+        if planner_filter and planner_verdict not in planner_filter:
+            continue
+        if ip_filter and ip_filter not in str(r.get("src_ip") or ""):
+            continue
+        out.append(r)
+    return out
+
 
-            color = combined_verdict_color(planner_verdict, detection_verdict)
-            icon = combined_icon(planner_verdict, detection_verdict)
+def render_card(r: dict):
+    planner = r.get("planner") or {}
+    detection = r.get("detection") or {}
+    response = r.get("response") or {}
+    planner_verdict, detection_verdict = verdicts_of(r)
 
-            st.markdown(
-                f"""
-                <div style="
-                    border-left: 6px solid {color};
-                    background-color: #1e1e1e;
-                    padding: 12px 18px;
-                    border-radius: 10px;
-                    margin-bottom: 12px;
-                ">
-                    <h4 style="margin: 0; color: {color};">
-                        {icon} Log <code>{r.get('log_id','unknown')}</code>
-                    </h4>
-                    <p style="margin: 4px 0; color: #aaa;">
-                        <b>Planner Verdict:</b> {planner_verdict} &nbsp; | &nbsp;
-                        <b>Detection Verdict:</b> {detection_verdict} &nbsp; | &nbsp;
-                        <b>Logged At:</b> {r.get("logged_at")}
-                    </p>
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
+    color = combined_verdict_color(planner_verdict, detection_verdict)
+    icon = combined_icon(planner_verdict, detection_verdict)
 
-            with st.expander("Detailed Analysis"):
-                st.markdown("**Planner Agent Output:**")
-                st.json(planner)
+    st.markdown(
+        f"""
+        <div style="
+            border-left: 6px solid {color};
+            background-color: #1e1e1e;
+            padding: 12px 18px;
+            border-radius: 10px;
+            margin-bottom: 12px;
+        ">
+            <h4 style="margin: 0; color: {color};">
+                {icon} Log <code>{r.get('log_id','unknown')}</code>
+            </h4>
+            <p style="margin: 4px 0; color: #aaa;">
+                <b>Source IP:</b> {r.get("src_ip") or "n/a"} &nbsp; | &nbsp;
+                <b>Planner Verdict:</b> {planner_verdict} &nbsp; | &nbsp;
+                <b>Detection Verdict:</b> {detection_verdict} &nbsp; | &nbsp;
+                <b>Logged At:</b> {r.get("logged_at")}
+            </p>
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
 
-                st.markdown("**Detection Agent Output:**")
-                st.json(detection)
+    # Detail payloads are only built for cards the analyst opens
+    if st.toggle("Detailed Analysis", key=f"details-{r.get('_row_id')}"):
+        st.markdown("**Planner Agent Output:**")
+        st.json(planner)
 
-                st.markdown("**Response Agent Output:**")
-                st.json(response if response else {"status": "No action triggered"})
+        st.markdown("**Detection Agent Output:**")
+        st.json(detection)
 
+        st.markdown("**Response Agent Output:**")
+        st.json(response if response else {"status": "No action triggered"})
 
+
+# -------------------------------
+# Filters + pagination (sidebar)
 # -------------------------------
-# Live polling loop
+with st.sidebar:
+    st.header("Filters")
+    detection_filter = st.multiselect(
+        "Detection verdict", ["malicious", "benign", "uncertain", "deferred", "skipped"])
+    planner_filter = st.multiselect("Planner verdict", ["malicious", "suspicious", "monitor", "benign"])
+    ip_filter = st.text_input("Source IP contains")
+    page_size = st.selectbox("Cards per page", [10, DASHBOARD_PAGE_SIZE, 50, 100], index=1)
+    page = st.number_input("Page", min_value=1, value=1, step=1)
+
+
 # -------------------------------
-st.toast("Live monitoring started")
+# Live feed (re-runs on its own every DASHBOARD_REFRESH_SECONDS)
+# -------------------------------
+@st.fragment(run_every=DASHBOARD_REFRESH_SECONDS)
+def live_feed():
+    seed_recent()
+    new_entries = read_new_lines()
+    if new_entries:
+        ingest(new_entries)
+
+    render_summary()
+
+    matches = filtered_results(detection_filter, planner_filter, ip_filter)
+    if not matches:
+        st.info("Waiting for logs to arrive..." if not st.session_state.results else "No traces match the filters.")
+        return
 
-while True:
-    new_logs = read_new_lines()
-    if new_logs:
-        for log in new_logs:
-            log_id = log.get("log_id") or f"unknown-{time.time()}"
-            log["log_id"] = log_id
-            log["logged_at"] = datetime.now(timezone.utc).isoformat()
-            st.session_state.results.append(log)
+    pages = max(1, -(-len(matches) // page_size))
+    current = min(int(page), pages)
+    start = (current - 1) * page_size
+    st.markdown(
+        f"<p style='font-size:14px; color:gray;'>Showing {start + 1}–{min(start + page_size, len(matches))} "
+        f"of {len(matches)} matching entries (page {current}/{pages}, "
+        f"last {len(st.session_state.results)} traces kept)</p>",
+        unsafe_allow_html=True
+    )
+    for r in matches[start:start + page_size]:
+        render_card(r)
 
-        render_dashboard()
-        st.toast(f"{len(new_logs)} new logs received")
 
-    time.sleep(1)
+live_feed()
@@ -0,0 +1,170 @@
+# llm/detection_prompt.py
+import json
+from typing import Any, Dict, List
+from utils.events import event_json
+
+EXAMPLES = [
+    {
+        "example_log": {"message":"SSH failed_login attempt from 1.2.3.4","conn_count":1},
+        "example_out": {"verdict":"benign","score":0.12,"reasons":["single failed login, low volume"],"recommended_action":"monitor"}
+    },
+    {
+        "example_log": {"message":"Multiple failed_login and bruteforce pattern from 203.0.113.5","conn_count":120},
+        "example_out": {"verdict":"malicious","score":0.93,"reasons":["high connection count","bruteforce pattern"],"recommended_action":"block_ip"}
+    }
+]
+
+OUTPUT_SPEC = [
+    '  verdict: one of "malicious", "benign", "uncertain"',
+    '  score: float between 0.0 and 1.0 (higher means more malicious) and anything above 0.5 including 0.5 is malicious under is benign',
+    '  reasons: array of short reasoning strings',
+    '  recommended_action: one of "block_ip","notify","monitor"',
+]
+
+
+BATCH_OUTPUT_LINE = ('Analyze every log independently. Output ONE JSON object ONLY, of the form {"verdicts": [...]}, '
+                     'with exactly one verdict object per log in the list, each with keys:')
+
+
+def _example_lines() -> List[str]:
+    lines = ["Here are examples (do NOT hallucinate beyond the fields):"]
+    for ex in EXAMPLES:
+        lines.append("LOG_EXAMPLE: " + json.dumps(ex["example_log"]))
+        lines.append("OUTPUT_EXAMPLE: " + json.dumps(ex["example_out"]))
+    return lines
+
+
+def build_single_prompt(log: Dict[str, Any]) -> str:
+    """
+    Strict prompt: ask LLM to output JSON ONLY with fields:
+    verdict (malicious|benign), score (0.0-1.0), reasons[], recommended_action
+    """
+    prompt_lines = ["You are a concise cybersecurity analyst. Given the single JSON log object below, output JSON ONLY with keys:"]
+    prompt_lines += OUTPUT_SPEC
+    prompt_lines.append("")
+    prompt_lines += _example_lines()
+    prompt_lines.append("")
+    prompt_lines.append("Now analyze this log and return JSON only:")
+    prompt_lines.append(event_json(log))
+    return "\n".join(prompt_lines)
+
+
+def build_batch_prompt(logs: List[Dict[str, Any]]) -> str:
+    """
+    Several logs in one request. The instructions and examples are sent once;
+    the LLM must answer with {"verdicts": [...]} holding one verdict object per
+    log, each tagged with the log's "index". The wrapper object keeps the reply
+    valid under Ollama's JSON mode, which only produces objects.
+    """
+    prompt_lines = [
+        f"You are a concise cybersecurity analyst. Below are {len(logs)} JSON log objects, each prefixed with LOG <index>.",
+        BATCH_OUTPUT_LINE,
+        "  index: the integer index of the log it refers to",
+    ]
+    prompt_lines += OUTPUT_SPEC
+    prompt_lines.append("")
+    prompt_lines += _example_lines()
+    prompt_lines.append("")
+    prompt_lines.append(f"Now analyze these {len(logs)} logs and return the JSON object only:")
+    for i, log in enumerate(logs):
+        prompt_lines.append(f"LOG {i}: " + event_json(log))
+    return "\n".join(prompt_lines)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars per token) used for batch sizing."""
+    return len(text) // 4 + 1
+
+
+# Template lengths of the JSON prompts without their logs (the batch one with a 1-digit count, twice)
+_JSON_SINGLE_CHARS = len(build_single_prompt({})) - len(event_json({}))
+_JSON_BATCH_CHARS = len(build_batch_prompt([])) - 2
+
+
+def estimate_json_prompt_tokens(logs: List[Dict[str, Any]], batch: bool) -> int:
+    """
+    estimate_tokens() of build_single_prompt / build_batch_prompt without
+    building them: the template lengths are fixed, and event_json is cached
+    on SuricataEvents.
+    """
+    if not batch:
+        return (_JSON_SINGLE_CHARS + len(event_json(logs[0]))) // 4 + 1
+    chars = _JSON_BATCH_CHARS + 2 * len(str(len(logs)))
+    chars += sum(len(f"\nLOG {i}: ") + len(event_json(log)) for i, log in enumerate(logs))
+    return chars // 4 + 1
+
+
+# -------------------------------
+# Compact prompts: relevant non-null fields only, key=value, constant prefix
+# -------------------------------
+COMMON_FIELDS = ("event_type", "app_proto", "proto", "src_ip", "src_port", "dest_ip", "dest_port", "direction")
+CONTEXT_FIELDS = ("message", "conn_count", "host_rules",
+                  "agg_src_flows", "agg_src_bytes", "agg_src_ports", "agg_pair_flows", "agg_sig_alerts")
+_HTTP_FIELDS = ("http_hostname", "http_url", "http_http_method", "http_status", "http_http_content_type",
+                "http_protocol")
+_FLOW_FIELDS = ("flow_pkts_toserver", "flow_pkts_toclient", "flow_bytes_toserver", "flow_bytes_toclient")
+EVENT_FIELDS = {
+    "alert": ("alert_signature_id", "alert_signature", "alert_severity", "alert_action", "alert_category")
+             + _HTTP_FIELDS + _FLOW_FIELDS,
+    "fileinfo": ("fileinfo_filename", "fileinfo_size", "fileinfo_state", "fileinfo_stored") + _HTTP_FIELDS,
+    "http": _HTTP_FIELDS,
+    "flow": _FLOW_FIELDS,
+}
+# never useful for a verdict (ids, clocks, sensor bookkeeping); used for unknown event types
+PROMPT_DROP_FIELDS = frozenset(("_id", "flow_id", "timestamp", "flow_start", "source", "filebeat_host_name",
+                                "alert_rev"))
+_PROMPT_FIELDS = {et: COMMON_FIELDS + fields + CONTEXT_FIELDS for et, fields in EVENT_FIELDS.items()}
+
+
+def _compact_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    text = str(value)
+    if not text or any(c in text for c in ' ="\n\t'):
+        return json.dumps(text, ensure_ascii=False)
+    return text
+
+
+def compact_log(log: Dict[str, Any]) -> str:
+    """One line of key=value pairs: the fields relevant to the log's event_type, nulls dropped."""
+    fields = _PROMPT_FIELDS.get(str(log.get("event_type") or "").lower())
+    if fields is None:
+        pairs = ((k, v) for k, v in log.items() if k not in PROMPT_DROP_FIELDS)
+    else:
+        pairs = zip(fields, map(log.get, fields))
+    return " ".join(f"{k}={_compact_value(v)}" for k, v in pairs if v is not None and v != "")
+
+
+def _compact_example_lines() -> List[str]:
+    lines = ["Here are examples (do NOT hallucinate beyond the fields):"]
+    for ex in EXAMPLES:
+        lines.append("LOG_EXAMPLE: " + compact_log(ex["example_log"]))
+        lines.append("OUTPUT_EXAMPLE: " + json.dumps(ex["example_out"]))
+    return lines
+
+
+# Built once and byte-identical on every call, so Ollama can reuse the KV cache for it.
+COMPACT_SINGLE_PREFIX = "\n".join(
+    ["You are a concise cybersecurity analyst. Each log is one line of key=value pairs "
+     "(fields that are absent were not observed). Given the single log below, output JSON ONLY with keys:"]
+    + OUTPUT_SPEC + [""] + _compact_example_lines() + ["", "Now analyze this log and return JSON only:", ""]
+)
+COMPACT_BATCH_PREFIX = "\n".join(
+    ["You are a concise cybersecurity analyst. Each log is one line of key=value pairs "
+     "(fields that are absent were not observed), prefixed with LOG <index>.",
+     BATCH_OUTPUT_LINE,
+     "  index: the integer index of the log it refers to"]
+    + OUTPUT_SPEC + [""] + _compact_example_lines() + [""]
+)
+
+
+def compact_suffix(log: Dict[str, Any]) -> str:
+    """Per-call part of the single-log prompt (follows COMPACT_SINGLE_PREFIX)."""
+    return "LOG: " + compact_log(log)
+
+
+def compact_batch_suffix(logs: List[Dict[str, Any]]) -> str:
+    """Per-call part of the batch prompt (follows COMPACT_BATCH_PREFIX)."""
+    lines = [f"Below are {len(logs)} logs; return the JSON object only:"]
+    lines += [f"LOG {i}: " + compact_log(log) for i, log in enumerate(logs)]
+    return "\n".join(lines)
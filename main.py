@@ -1,46 +1,188 @@
 # main.py
 from core.graph import AgentGraph
-from utils.config import LOCAL_LOG_PATH
+from utils.config import (
+    LOCAL_LOG_PATH, TAIL_OFFSET_PATH, TAIL_POLL_INTERVAL, INGEST_BATCH_MAX, INGEST_BATCH_MAX_WAIT,
+    HANDOFF_QUEUE_SIZE, HANDOFF_AUDIT_LOG, SHARD_COUNT, STATS_LOG_EVERY_BATCHES, STATS_LOG_INTERVAL
+)
+from utils.tailer import NDJSONTailer
+from utils.batching import MicroBatcher, HandoffQueue
+from utils.db_logger import TraceWriter
+from utils.events import event_json
+import argparse
 import json
-import time
-import re
 import os
+import threading
+import time
+
+def summarize_batch(results, elapsed: float) -> str:
+    escalated = [r for r in results if (r.get("detection") or {}).get("verdict") != "skipped"]
+    malicious = [r for r in escalated if r["detection"].get("verdict") == "malicious"]
+    cache_hits = sum(1 for r in escalated if r["detection"].get("cache_hit"))
+    prefiltered = sum(1 for r in escalated if r["detection"].get("source") == "prefilter")
+    coalesced = sum(1 for r in escalated if (r.get("coalesced") or {}).get("into") not in (None, r.get("log_id")))
+    actions = sum(1 for r in results if r.get("response") and r["response"].get("status") != "suppressed")
+    suppressed = sum(1 for r in results if (r.get("response") or {}).get("status") == "suppressed")
+    deferred = sum(1 for r in escalated if r["detection"].get("verdict") == "deferred")
+    max_score = max((r.get("planner", {}).get("score", 0) for r in results), default=0)
+
+    line = (f"BATCH: {len(results)} logs | escalated: {len(escalated)} (cache hits: {cache_hits}, coalesced: {coalesced}, prefiltered: {prefiltered}) | "
+            f"malicious: {len(malicious)} | deferred: {deferred} | actions: {actions} (suppressed: {suppressed}) | max planner_score: {max_score:.2f} | "
+            f"{elapsed * 1000:.1f} ms")
+    if malicious:
+        line += "\n  malicious: " + ", ".join(str(r.get("log_id") or "N/A") for r in malicious[:10])
+        if len(malicious) > 10:
+            line += f" (+{len(malicious) - 10} more)"
+    return line
+
+
+class StatsLogger:
+    """Prints g.stats() (cache, prefilter, scheduler, LLM endpoints, ...) every few batches / seconds."""
+
+    def __init__(self, g, every_batches: int = STATS_LOG_EVERY_BATCHES, interval: float = STATS_LOG_INTERVAL):
+        self.g = g
+        self.every_batches = every_batches
+        self.interval = interval
+        self._batches = 0
+        self._last = time.monotonic()
 
-def follow(file_path, sleep_time=0.5):
+    def batch_done(self):
+        self._batches += 1
+        if self._batches >= self.every_batches or time.monotonic() - self._last >= self.interval:
+            self.log()
+
+    def log(self, label: str = "STATS"):
+        self._batches, self._last = 0, time.monotonic()
+        try:
+            stats = self.g.stats()
+        except Exception as e:
+            print(f"{label}: unavailable ({type(e).__name__}: {e})")
+            return
+        print(f"{label}: {json.dumps(stats, default=str)}")
+
+
+def processed(g, batches, logs_of=None):
     """
-    Generator to follow a file continuously.
-    Yields new JSON log objects as they are appended.
+    (batch, results, elapsed seconds) per non-empty batch, in order; `batches`
+    yields [] while the source is idle. A ShardedGraph keeps several batches
+    in flight (ShardedGraph.pipeline), an AgentGraph takes one at a time.
     """
-    with open(file_path, "r", encoding="utf-8") as f:
-        f.seek(0, os.SEEK_END)  # start at end of file
-
-        while True:
-            line = f.readline()
-            if not line:
-                # EOF reached, sleep before retrying
-                time.sleep(sleep_time)
-                continue
-
-            line = line.strip()
-            if not line:
-                continue
-
-            # Extract all JSON objects in case multiple per line
-            for match in re.finditer(r"\{.*?\}", line, flags=re.S):
-                try:
-                    yield json.loads(match.group(0))
-                except json.JSONDecodeError:
-                    continue
+    if hasattr(g, "pipeline"):
+        yield from g.pipeline(batches, logs_of)
+        return
+    for batch in batches:
+        if batch:
+            started = time.perf_counter()
+            results = g.process_many(logs_of(batch) if logs_of else batch)
+            yield batch, results, time.perf_counter() - started
 
-if __name__ == "__main__":
-    g = AgentGraph()
-    print(f"Live log processing started — following {LOCAL_LOG_PATH}")
 
-    for log in follow(LOCAL_LOG_PATH, sleep_time=0.5):
-        result = g.process_many([log])[0]  # process one log at a time
-        log_id = result.get("log_id") or "N/A"
-        planner_score = result.get("planner", {}).get("score", 0)
-        detection_verdict = result.get("detection", {}).get("verdict", "skipped")
+def run_file(g):
+    """Follow LOCAL_LOG_PATH (written by agents/monitor_agent.py in another process)."""
+    print(f"Live log processing started — following {LOCAL_LOG_PATH} "
+          f"(batches of up to {INGEST_BATCH_MAX} logs / {INGEST_BATCH_MAX_WAIT * 1000:.0f} ms, "
+          f"max {g.max_inflight} detections in flight)")
+
+    tailer = NDJSONTailer(LOCAL_LOG_PATH, offset_path=TAIL_OFFSET_PATH, poll_interval=TAIL_POLL_INTERVAL)
+    # items are (position, log): the batcher may hold read-ahead lines that aren't processed yet,
+    # so the persisted offset only advances to the end of the last processed line
+    batcher = MicroBatcher(tailer.poll_marked, max_size=INGEST_BATCH_MAX, max_wait=INGEST_BATCH_MAX_WAIT)
+    stats = StatsLogger(g)
+    try:
+        for batch, results, elapsed in processed(g, iter(batcher.next_batch, None),
+                                                 logs_of=lambda b: [log for _, log in b]):
+            tailer.commit(batch[-1][0])  # batch fully processed → advance the persisted offset to it
+            print(summarize_batch(results, elapsed))
+            stats.batch_done()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tailer.close()
+        stats.log("FINAL STATS")
+
+
+def run_graylog(g, audit: bool = HANDOFF_AUDIT_LOG, queue_size: int = HANDOFF_QUEUE_SIZE):
+    """
+    Combined mode: the Graylog poller runs in this process and hands events
+    to the pipeline through a bounded in-memory queue (no file round trip).
+    When the queue is full the poller waits, so detection sets the pace.
+    With `audit`, events are also appended to LOCAL_LOG_PATH by a background writer.
+    """
+    from agents import monitor_agent
+
+    handoff = HandoffQueue(queue_size)
+    audit_writer = None
+    if audit:
+        os.makedirs(os.path.dirname(LOCAL_LOG_PATH) or ".", exist_ok=True)
+        audit_writer = TraceWriter(data_dir=os.path.dirname(LOCAL_LOG_PATH) or ".")
+    audit_name = os.path.basename(LOCAL_LOG_PATH)
+
+    def forward(logs):
+        if audit_writer is not None:
+            # encode here: the planner attaches agg_* to these same events while the writer thread runs
+            for log in logs:
+                audit_writer.write_encoded(audit_name, log, event_json(log))
+        if handoff.put_many(logs) < len(logs):
+            raise InterruptedError("pipeline stopped")  # don't advance the Graylog cursor
+
+    def poller():
+        try:
+            monitor_agent.main_loop(sink=forward, stop=stop)
+        except InterruptedError:
+            pass
+
+    print(f"Live log processing started — Graylog → in-process queue (max {handoff.maxsize} events, "
+          f"audit log: {LOCAL_LOG_PATH if audit else 'off'}, max {g.max_inflight} detections in flight)")
+    stop = threading.Event()
+    thread = threading.Thread(target=poller, name="graylog-poller", daemon=True)
+    thread.start()
+
+    def report(results, elapsed):
+        q = handoff.stats()
+        print(summarize_batch(results, elapsed) +
+              f"\n  queue: {q['depth']}/{q['maxsize']} (peak {q['peak_depth']}) | "
+              f"poller blocked {q['blocked_seconds']:.1f}s")
+        stats.batch_done()
+
+    stats = StatsLogger(g)
+    batcher = MicroBatcher(handoff.poll, max_size=INGEST_BATCH_MAX, max_wait=INGEST_BATCH_MAX_WAIT)
+    try:
+        for _, results, elapsed in processed(g, iter(batcher.next_batch, None)):
+            report(results, elapsed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        handoff.close()
+        thread.join(timeout=5)
+        # events already taken off Graylog (cursor advanced) are processed before exiting
+        for _, results, elapsed in processed(g, iter(batcher.next_batch, [])):
+            report(results, elapsed)
+        if audit_writer is not None:
+            audit_writer.close()
+        stats.log("FINAL STATS")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AutoSentry live pipeline")
+    parser.add_argument("--source", choices=["file", "graylog"], default="file",
+                        help="file: tail LOCAL_LOG_PATH; graylog: poll Graylog in-process")
+    parser.add_argument("--no-audit", action="store_true",
+                        help="with --source graylog, don't append events to LOCAL_LOG_PATH")
+    parser.add_argument("--shards", type=int, default=SHARD_COUNT,
+                        help="run the pipeline in N processes partitioned by src_ip (1 = single process)")
+    args = parser.parse_args()
 
-        print(f"TRACE: {log_id} | planner_score: {planner_score:.2f} | detection: {detection_verdict}")
-        time.sleep(0.05)  # small sleep to avoid spamming output
\ No newline at end of file
+    if args.shards > 1:
+        from core.sharding import ShardedGraph
+        g = ShardedGraph(args.shards)
+        print(f"Sharded mode: {args.shards} worker processes by src_ip, "
+              f"{g.per_shard_inflight} detections in flight per shard")
+    else:
+        g = AgentGraph()
+    try:
+        if args.source == "graylog":
+            run_graylog(g, audit=HANDOFF_AUDIT_LOG and not args.no_audit)
+        else:
+            run_file(g)
+    finally:
+        g.close()
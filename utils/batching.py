@@ -0,0 +1,139 @@
+# utils/batching.py
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Iterable, Iterator, List, Tuple
+
+
+class MicroBatcher:
+    """
+    Groups items from a polling source into batches that are flushed when
+    they reach max_size or when max_wait seconds have passed since the first
+    item of the batch arrived, whichever comes first.
+
+    `poll(timeout)` must return a (possibly empty) list of new items, waiting
+    at most `timeout` seconds.
+    """
+
+    def __init__(self, poll: Callable[[float], List[Any]], max_size: int = 256,
+                 max_wait: float = 0.05, idle_timeout: float = 1.0):
+        self.poll = poll
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.idle_timeout = idle_timeout
+        self._overflow: List[Any] = []
+
+    def next_batch(self) -> List[Any]:
+        """Next batch, or [] if nothing arrived within idle_timeout."""
+        batch = self._overflow
+        self._overflow = []
+        if not batch:
+            batch = self.poll(self.idle_timeout)
+            if not batch:
+                return []
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            batch.extend(self.poll(remaining))
+
+        if len(batch) > self.max_size:
+            batch, self._overflow = batch[:self.max_size], batch[self.max_size:]
+        return batch
+
+    def __iter__(self) -> Iterator[List[Any]]:
+        while True:
+            batch = self.next_batch()
+            if batch:
+                yield batch
+
+
+class HandoffQueue:
+    """
+    Bounded in-memory FIFO between a producer thread (e.g. the Graylog
+    poller) and a MicroBatcher consumer. put_many() blocks while the queue
+    is full, so a slow consumer slows the producer down instead of letting
+    a backlog grow; poll(timeout) matches the MicroBatcher source contract.
+    """
+
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = max(1, int(maxsize))
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.enqueued = 0
+        self.peak_depth = 0
+        self.blocked_seconds = 0.0  # time producers spent waiting for room
+
+    def put_many(self, items: List[Any]) -> int:
+        """Enqueue items in order, waiting for room as needed. Returns how many were queued before close()."""
+        put = 0
+        with self._cond:
+            for item in items:
+                if len(self._items) >= self.maxsize and not self._closed:
+                    started = time.monotonic()
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                    self.blocked_seconds += time.monotonic() - started
+                if self._closed:
+                    break
+                self._items.append(item)
+                put += 1
+                self.peak_depth = max(self.peak_depth, len(self._items))
+                self._cond.notify_all()
+            self.enqueued += put
+        return put
+
+    def poll(self, timeout: float) -> List[Any]:
+        """Everything queued right now, waiting up to `timeout` seconds for the first item."""
+        with self._cond:
+            if not self._items and not self._closed and timeout > 0:
+                self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            items = list(self._items)
+            self._items.clear()
+            if items:
+                self._cond.notify_all()
+            return items
+
+    def close(self):
+        """Wake blocked producers and consumers; later puts are dropped."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "depth": len(self._items),
+                "maxsize": self.maxsize,
+                "peak_depth": self.peak_depth,
+                "enqueued": self.enqueued,
+                "blocked_seconds": round(self.blocked_seconds, 3),
+            }
+
+
+def pipelined(submit: Callable[[List[Any]], Any], result: Callable[[Any], List[Any]], done: Callable[[Any], bool],
+              batches: Iterable[List[Any]], depth: int,
+              logs_of: Callable[[List[Any]], List[Any]] = None) -> Iterator[Tuple[List[Any], List[Any], float]]:
+    """
+    (batch, results, seconds from submit to result) for each non-empty batch,
+    in order, with up to `depth` batches submitted ahead. An empty batch
+    means the source is idle: everything still in flight is collected then.
+    `logs_of` maps a batch to what submit() takes (e.g. drop tailer positions).
+    """
+    pending = deque()
+    for batch in batches:
+        if batch:
+            pending.append((batch, submit(logs_of(batch) if logs_of else batch), time.perf_counter()))
+        while pending and (len(pending) >= depth or not batch or done(pending[0][1])):
+            batch_, ticket, started = pending.popleft()
+            yield batch_, result(ticket), time.perf_counter() - started
+    while pending:
+        batch_, ticket, started = pending.popleft()
+        yield batch_, result(ticket), time.perf_counter() - started
@@ -13,3 +13,143 @@ RBF_PKTS_THRESHOLD = 100
 RBF_BYTES_THRESHOLD = 100_000
 SCORE_THRESHOLD_SUSPICIOUS = 0.2
 LLM_TIMEOUT = 600  # seconds
+
+# Detection concurrency
+DETECTION_MAX_INFLIGHT = 4  # max concurrent DetectionAgent.analyze calls (1 = sequential)
+
+# Detection verdict cache (LRU + TTL, keyed on a log fingerprint)
+VERDICT_CACHE_ENABLED = True
+VERDICT_CACHE_SIZE = 4096
+VERDICT_CACHE_TTL = 600  # seconds
+# Fields left out of the fingerprint; glob patterns allowed
+VERDICT_CACHE_VOLATILE_FIELDS = [
+    "_id", "flow_id", "timestamp", "flow_start",
+    "src_port", "dest_port", "flow_pkts_*", "flow_bytes_*", "agg_*",
+]
+
+# Batched detection prompts (several logs per LLM call)
+DETECTION_BATCH_MAX = 8               # max logs packed into one prompt
+DETECTION_BATCH_TOKEN_BUDGET = 2048   # est. tokens for log payloads + answers per prompt
+DETECTION_TOKENS_PER_VERDICT = 60     # est. answer tokens reserved per log
+
+# LLM client (pooled session, keep-alive, JSON-constrained output)
+LLM_KEEP_ALIVE = "30m"   # how long Ollama keeps the model loaded after a call
+LLM_JSON_MODE = True     # send format="json" so generation stops at the JSON object
+LLM_NUM_PREDICT = 256    # max generated tokens for a single-log verdict
+LLM_TEMPERATURE = 0.0
+LLM_POOL_SIZE = DETECTION_MAX_INFLIGHT  # pooled keep-alive connections to Ollama
+LLM_WARMUP = True        # load the model when AgentGraph starts
+LLM_STREAM = True        # stream tokens and hang up once the verdict JSON is complete
+
+# Text fields the planner's keyword matcher scans (None = whole log as JSON)
+RBF_TEXT_FIELDS = [
+    "message", "app_proto", "alert_signature", "alert_category",
+    "http_hostname", "http_url", "http_http_method", "http_http_content_type",
+    "fileinfo_filename",
+]
+
+# Log tailer (main.py)
+TAIL_OFFSET_PATH = "data/logs.ndjson.offset"  # persisted byte offset into LOCAL_LOG_PATH
+TAIL_POLL_INTERVAL = 0.5  # seconds; only used when inotify is unavailable
+
+# Micro-batching ingest loop (main.py)
+INGEST_BATCH_MAX = 256      # flush once this many logs are collected...
+INGEST_BATCH_MAX_WAIT = 0.05  # ...or this many seconds after the first one arrived
+
+# Pipeline stats in the live loop (main.py): g.stats() is printed this often and on shutdown
+STATS_LOG_EVERY_BATCHES = 100  # after this many batches...
+STATS_LOG_INTERVAL = 60.0      # ...or this many seconds, whichever comes first
+
+# Trace / action writer (utils/db_logger.py)
+TRACE_WRITER_QUEUE_SIZE = 10_000     # pending records before log_trace/log_action block
+TRACE_WRITER_FLUSH_RECORDS = 500     # write out once this many records are buffered...
+TRACE_WRITER_FLUSH_INTERVAL = 0.5    # ...or after this many seconds
+TRACE_WRITER_FSYNC = "interval"      # "always" | "interval" | "never"
+TRACE_WRITER_FSYNC_INTERVAL = 5.0    # seconds between fsyncs for "interval"
+
+# SQLite trace store (utils/trace_store.py), fed by the trace writer
+TRACE_DB_ENABLED = True
+TRACE_DB_PATH = "data/traces.db"
+TRACE_DB_RETENTION_DAYS = 7         # drop traces older than this
+TRACE_DB_MAX_ROWS = 1_000_000       # and keep at most this many rows
+TRACE_DB_COMPACT_INTERVAL = 300     # seconds between retention/WAL checkpoint runs
+
+# Streamlit dashboard
+DASHBOARD_MAX_RESULTS = 2000     # ring buffer of traces kept per session
+DASHBOARD_PAGE_SIZE = 25
+DASHBOARD_REFRESH_SECONDS = 1.0
+DASHBOARD_BUCKET_SECONDS = 60    # width of the time-bucketed counts
+DASHBOARD_BUCKETS = 60           # how many buckets the chart keeps
+
+# Combined mode (main.py --source graylog): Graylog poller → in-memory queue → AgentGraph
+HANDOFF_QUEUE_SIZE = 2048    # events buffered between poller and planner; a full queue stalls the poller
+HANDOFF_AUDIT_LOG = True     # also append every event to LOCAL_LOG_PATH (async, off the hot path)
+
+# Per-host sliding-window aggregates (utils/host_stats.py), attached to logs as agg_* fields
+AGG_WINDOW_SECONDS = 60
+AGG_BUCKET_SECONDS = 10
+AGG_MAX_HOSTS = 50_000          # src_ip entries kept (LRU)
+AGG_MAX_PAIRS = 200_000         # (src_ip, dest_port) entries kept (LRU)
+AGG_MAX_PORTS_PER_HOST = 4096   # distinct dest ports tracked per src_ip
+AGG_MAX_SIGS_PER_HOST = 256     # alert signatures tracked per src_ip
+AGG_EPHEMERAL_PORT_MIN = 32768  # server ports at or above this are client-side ephemeral ports, not counted
+
+# Planner rules on the aggregates (counts are per AGG_WINDOW_SECONDS)
+RBF_SCAN_DISTINCT_PORTS = 25        # distinct dest ports from one src_ip → port scan
+RBF_BRUTEFORCE_FLOWS = 30           # flows from one src_ip to one login port → brute force
+RBF_BRUTEFORCE_PORTS = [21, 22, 23, 25, 110, 143, 445, 1433, 3306, 3389, 5432, 5900]
+RBF_REPEAT_SIGNATURE_ALERTS = 10    # same alert signature from one src_ip
+RBF_AGG_CONCLUSIVE = False          # True: scan / brute force → planner verdict "malicious", no LLM call
+                                    # (off: they raise the score and escalate, the LLM decides)
+# aggregate rules copied onto the log as "host_rules": when they change, a new coalescing burst starts
+# and the verdict cache misses, so alerts after a scan shows up get a fresh verdict
+RBF_AGG_KEY_RULES = ["high_conn_rate", "port_scan", "brute_force"]
+
+# Alert coalescing (core/coalesce.py): one detection call per burst of identical alerts
+COALESCE_ENABLED = True
+COALESCE_WINDOW_SECONDS = 60    # followers reuse the leader's verdict this long after the leader arrived
+COALESCE_MAX_BURSTS = 10_000    # (src_ip, alert_signature_id) bursts remembered
+
+# Detection prompt encoding (llm/detection_prompt.py)
+DETECTION_PROMPT_COMPACT = True  # key=value lines, only non-null fields relevant to the event_type
+LLM_CONTEXT_REUSE = False        # evaluate the constant prompt prefix once and send Ollama's `context` with each call
+
+# ResponseAgent: TTL blocklist + batched enforcement (agents/response_agent.py, utils/enforcement.py)
+RESPONSE_BLOCK_TTL = 3600            # seconds an action on a target stays in force; repeats inside it are no-ops
+RESPONSE_APPLY_INTERVAL = 2.0        # new block targets are pushed to the backend this often...
+RESPONSE_BATCH_MAX = 256             # ...or as soon as this many are pending
+RESPONSE_BACKEND = "nftables_file"   # "nftables_file" (local nft script stand-in) or "none"
+RESPONSE_NFT_SET_PATH = "data/blocklist.nft"
+RESPONSE_NFT_TABLE = "inet filter"
+RESPONSE_NFT_SET = "autosentry_block"  # sets are <name>_v4 / <name>_v6
+
+# Detection scheduler (core/scheduler.py): priority queue + load shedding between planner and detection
+SCHED_ENABLED = True
+SCHED_MAX_DEPTH = 1024        # queued escalations; past this the lowest-priority ones are deferred
+GRAPH_PIPELINE_DEPTH = 8      # micro-batches main.py keeps in flight; 8 x INGEST_BATCH_MAX can outgrow SCHED_MAX_DEPTH
+SCHED_MAX_WAIT = 120          # seconds; items that waited longer are deferred instead of analyzed
+SCHED_LATENCY_LEVEL = 30.0    # seconds per detection call (EWMA) that counts as overloaded...
+SCHED_PRESSURE_DEPTH = 64     # ...and then the queue is trimmed to this depth
+SCHED_SEVERITY_WEIGHT = 0.5   # priority bonus for alert_severity 1 (0.25 for 2, 0 for 3)
+SCHED_AGE_WEIGHT = 0.01       # priority gained per second of waiting
+
+# Pre-classifier ahead of the LLM (utils/prefilter.py); train with `python -m utils.prefilter`
+PREFILTER_ENABLED = True             # used only once PREFILTER_MODEL_PATH exists
+PREFILTER_MODEL_PATH = "data/prefilter.npz"
+PREFILTER_HASH_BITS = 18             # 2**18 hashed features
+PREFILTER_BENIGN_BELOW = 0.03        # P(malicious) at or below this → benign without the LLM
+PREFILTER_MALICIOUS_ABOVE = 0.97     # at or above this → malicious without the LLM
+
+# Sharded run mode (core/sharding.py, main.py --shards N): one AgentGraph process per crc32(src_ip) % N
+SHARD_COUNT = 1               # 1 = single process
+SHARD_QUEUE_SIZE = 4          # batches in flight per shard (pipeline depth) before the parent blocks
+SHARD_POLL_INTERVAL = 1.0     # seconds between liveness checks while waiting on shard replies
+
+# LLM endpoint pool (utils/llm_client.LLMPool): used when more than one Ollama host is listed
+OLLAMA_ENDPOINTS = [OLLAMA_BASE]   # e.g. ["http://10.0.0.5:11434", "http://10.0.0.6:11434"]
+LLM_ENDPOINT_MAX_INFLIGHT = 4      # concurrent requests per endpoint; callers wait when all are full
+LLM_EJECT_AFTER_FAILURES = 3       # consecutive failed calls before an endpoint is taken out of rotation...
+LLM_EJECT_SECONDS = 30             # ...for this long, then one probe request decides whether it comes back
+LLM_HEDGE = False                  # re-send slow calls to a second endpoint and take the first valid answer
+LLM_HEDGE_PERCENTILE = 95          # a call is slow once it outlives this percentile of recent latencies
+LLM_HEDGE_MIN_DELAY = 1.0          # seconds; floor for the hedge deadline (also used until latencies are known)
@@ -1,15 +1,238 @@
 # utils/db_logger.py
-import json
+import atexit
+import os
+import queue
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
+from typing import Any, Callable, Dict, List
+from .config import (
+    TRACE_WRITER_QUEUE_SIZE, TRACE_WRITER_FLUSH_RECORDS, TRACE_WRITER_FLUSH_INTERVAL,
+    TRACE_WRITER_FSYNC, TRACE_WRITER_FSYNC_INTERVAL, TRACE_DB_ENABLED, TRACE_DB_PATH
+)
+from .events import event_json
 
 DATA_DIR = Path("data")
 DATA_DIR.mkdir(exist_ok=True)
 
+
+class TraceWriter:
+    """
+    Group-committing JSONL writer. Callers serialize and enqueue records; a
+    background thread keeps one open handle per file and writes in batches
+    once flush_records are pending or flush_interval has passed.
+
+    fsync policy: "always" (after every batch), "interval" (at most every
+    fsync_interval seconds) or "never" (leave it to the OS).
+    The queue is bounded: when the disk can't keep up, write() blocks.
+    A failed batch is reported (errors / last_error) and the thread carries
+    on; should the thread die anyway, write() and flush() raise.
+
+    `sinks` maps a filename to a callable receiving each written batch as
+    (records, json_lines), e.g. TraceStore.insert_many for traces.log.
+    """
+
+    _STOP = object()
+
+    def __init__(self, data_dir: Path = DATA_DIR, max_queue: int = TRACE_WRITER_QUEUE_SIZE,
+                 flush_records: int = TRACE_WRITER_FLUSH_RECORDS, flush_interval: float = TRACE_WRITER_FLUSH_INTERVAL,
+                 fsync: str = TRACE_WRITER_FSYNC, fsync_interval: float = TRACE_WRITER_FSYNC_INTERVAL,
+                 sinks: Dict[str, Callable[[List[dict], List[str]], Any]] = None):
+        if fsync not in ("always", "interval", "never"):
+            raise ValueError(f"unknown fsync policy: {fsync}")
+        self.data_dir = Path(data_dir)
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.sinks = dict(sinks or {})
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._handles = {}
+        self._buffers = {}
+        self._sink_records = {}
+        self._pending = 0
+        self._last_fsync = time.monotonic()
+        self._closed = False
+        self.written = 0
+        self.errors = 0
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    # -------------------------------
+    # Producer side
+    # -------------------------------
+    def write(self, filename: str, obj: dict):
+        """
+        Serialize now, in the caller's thread, and queue the line. Encoding on
+        the writer thread would race with callers still updating the record.
+        """
+        try:
+            line = event_json(obj)  # reuses a SuricataEvent's cached encoding
+        except (TypeError, ValueError, RuntimeError) as e:
+            print(f"TraceWriter: dropping unserializable record for {filename}: {e}")
+            return
+        self._put((filename, obj, line))
+
+    def write_encoded(self, filename: str, obj: dict, line: str):
+        """write() for a record already serialized (e.g. in a shard process)."""
+        self._put((filename, obj, line))
+
+    def flush(self, timeout: float = None) -> bool:
+        """Block until everything enqueued so far is written to the files."""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._put((None, done, None))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not done.wait(0.5 if deadline is None else max(0.0, min(0.5, deadline - time.monotonic()))):
+            self._check_alive()
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+        return True
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put((None, self._STOP, None))
+            self._thread.join()
+
+    def _put(self, item: tuple):
+        """Queue an item, blocking while the queue is full; raises instead once the writer thread is gone."""
+        if self._closed:
+            raise RuntimeError("TraceWriter is closed")
+        while True:
+            self._check_alive()
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _check_alive(self):
+        if not self._thread.is_alive():
+            raise RuntimeError(f"TraceWriter thread is not running (last error: {self.last_error})")
+
+    # -------------------------------
+    # Writer thread
+    # -------------------------------
+    def _run(self):
+        try:
+            self._loop()
+        except BaseException as e:
+            self.last_error = repr(e)
+            print(f"TraceWriter: writer thread stopped: {e!r}")
+
+    def _loop(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                filename, obj, line = self._queue.get(timeout=max(0.0, next_flush - time.monotonic()))
+            except queue.Empty:
+                filename, obj, line = None, None, None
+
+            if filename is not None:
+                self._buffers.setdefault(filename, []).append(line + "\n")
+                if filename in self.sinks:
+                    self._sink_records.setdefault(filename, []).append(obj)
+                self._pending += 1
+                if self._pending < self.flush_records and time.monotonic() < next_flush:
+                    continue
+
+            self._write_out()
+            next_flush = time.monotonic() + self.flush_interval
+            if obj is self._STOP:
+                for f in self._handles.values():
+                    f.close()
+                self._handles.clear()
+                return
+            if isinstance(obj, threading.Event):
+                obj.set()
+
+    def _write_out(self):
+        """Write every buffered file; an error loses that file's batch (reported), not the writer."""
+        if not self._pending:
+            return
+        for filename, lines in self._buffers.items():
+            if not lines:
+                continue
+            records = self._sink_records.pop(filename, [])
+            try:
+                f = self._handles.get(filename)
+                if f is None:
+                    f = open(self.data_dir / filename, "a", encoding="utf-8")
+                    self._handles[filename] = f
+                f.write("".join(lines))
+                f.flush()
+            except OSError as e:
+                self._fail(f"writing {len(lines)} records to {filename} failed: {e}")
+                self._drop_handle(filename)
+                lines.clear()
+                continue
+            if filename in self.sinks:
+                try:
+                    self.sinks[filename](records, [l.rstrip("\n") for l in lines])
+                except Exception as e:
+                    self._fail(f"sink for {filename} failed: {e}")
+            lines.clear()
+        self.written += self._pending
+        self._pending = 0
+
+        now = time.monotonic()
+        if self.fsync == "always" or (self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval):
+            for filename, f in list(self._handles.items()):
+                try:
+                    os.fsync(f.fileno())
+                except OSError as e:
+                    self._fail(f"fsync of {filename} failed: {e}")
+                    self._drop_handle(filename)
+            self._last_fsync = now
+
+    def _drop_handle(self, filename: str):
+        f = self._handles.pop(filename, None)
+        if f is not None:
+            try:
+                f.close()
+            except OSError:
+                pass
+
+    def _fail(self, message: str):
+        self.errors += 1
+        self.last_error = message
+        print(f"TraceWriter: {message}")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> TraceWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                sinks = {}
+                if TRACE_DB_ENABLED:
+                    from .trace_store import TraceStore
+                    sinks["traces.log"] = TraceStore(TRACE_DB_PATH).insert_many
+                _writer = TraceWriter(sinks=sinks)
+                atexit.register(_writer.close)
+    return _writer
+
+
+def use_writer(writer):
+    """Send log_trace / log_action to `writer` (write / flush / close) instead of the default TraceWriter."""
+    global _writer
+    with _writer_lock:
+        _writer = writer
+
+
 def append_jsonl(filename: str, obj: dict):
-    p = DATA_DIR / filename
-    with open(p, "a", encoding="utf-8") as f:
-        f.write(json.dumps(obj, default=str) + "\n")
+    get_writer().write(filename, obj)
 
 def log_trace(trace: dict):
     trace["logged_at"] = datetime.utcnow().isoformat() + "Z"
@@ -18,3 +241,10 @@ def log_trace(trace: dict):
 def log_action(action: dict):
     action["logged_at"] = datetime.utcnow().isoformat() + "Z"
     append_jsonl("actions.log", action)
+
+def flush(timeout: float = None) -> bool:
+    return get_writer().flush(timeout) if _writer is not None else True
+
+def close():
+    if _writer is not None:
+        _writer.close()
@@ -0,0 +1,81 @@
+# utils/enforcement.py
+import ipaddress
+import os
+import time
+from typing import Dict, List
+from .config import RESPONSE_BACKEND, RESPONSE_NFT_SET_PATH, RESPONSE_NFT_TABLE, RESPONSE_NFT_SET
+
+
+class EnforcementBackend:
+    """
+    Where ResponseAgent pushes block decisions. apply() gets every target
+    that is currently blocked as {target: expires_at (epoch)}, plus the ones
+    new in this batch, and returns how many new targets were applied.
+    """
+
+    name = "none"
+
+    def apply(self, active: Dict[str, float], new: List[str]) -> int:
+        return 0
+
+    def close(self):
+        pass
+
+
+class NftablesSetFile(EnforcementBackend):
+    """
+    Local stand-in for a firewall: rewrites an nftables script holding the
+    blocklist as two timed sets (IPv4 / IPv6), loadable with `nft -f`.
+    The file is replaced atomically, so a reader never sees half a batch.
+    """
+
+    name = "nftables_file"
+
+    def __init__(self, path: str = RESPONSE_NFT_SET_PATH, table: str = RESPONSE_NFT_TABLE,
+                 set_name: str = RESPONSE_NFT_SET):
+        self.path = path
+        self.table = table
+        self.set_name = set_name
+
+    def apply(self, active: Dict[str, float], new: List[str]) -> int:
+        now = time.time()
+        elements = {4: [], 6: []}
+        for target, expires_at in sorted(active.items()):
+            try:
+                version = ipaddress.ip_address(target).version
+            except ValueError:
+                continue  # not an address (hostname, empty); nothing nftables can match
+            elements[version].append(f"{target} timeout {max(1, int(expires_at - now))}s")
+
+        lines = [f"# generated by AutoSentry ResponseAgent at {time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now))}"]
+        for version, addr_type in ((4, "ipv4_addr"), (6, "ipv6_addr")):
+            set_name = f"{self.set_name}_v{version}"
+            lines.append(f"add set {self.table} {set_name} {{ type {addr_type}; flags timeout; }}")
+            lines.append(f"flush set {self.table} {set_name}")
+            if elements[version]:
+                lines.append(f"add element {self.table} {set_name} {{ " + ", ".join(elements[version]) + " }")
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.path)
+
+        applied = 0
+        for target in new:
+            try:
+                ipaddress.ip_address(target)
+                applied += 1
+            except ValueError:
+                pass
+        return applied
+
+
+BACKENDS = {"none": EnforcementBackend, "nftables_file": NftablesSetFile}
+
+
+def get_backend(name: str = RESPONSE_BACKEND) -> EnforcementBackend:
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"unknown enforcement backend: {name}") from None
@@ -0,0 +1,184 @@
+# utils/events.py
+import json
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# Unified field order (works for both alert and fileinfo)
+FIELDS_ORDER = [
+    # Common metadata
+    "timestamp", "event_type", "app_proto", "proto",
+    "src_ip", "src_port", "dest_ip", "dest_port", "direction",
+
+    # Alert-specific fields
+    "alert_signature_id", "alert_signature", "alert_rev",
+    "alert_severity", "alert_action", "alert_category",
+
+    # Fileinfo-specific fields
+    "fileinfo_filename", "fileinfo_size", "fileinfo_state", "fileinfo_stored",
+
+    # HTTP-related fields
+    "http_protocol", "http_hostname", "http_http_method",
+    "http_url", "http_status", "http_http_content_type",
+
+    # Flow-related stats
+    "flow_id", "flow_pkts_toserver", "flow_pkts_toclient",
+    "flow_bytes_toserver", "flow_bytes_toclient", "flow_start",
+
+    # Sensor/host info
+    "source", "filebeat_host_name", "_id"
+]
+
+# Suricata sub-objects Graylog may leave un-flattened: "alert_signature" -> msg["alert"]["signature"]
+NESTED_PREFIXES = ("http", "fileinfo", "flow", "alert")
+
+_MISSING = object()
+
+
+def compile_plan(fields) -> Tuple[Tuple[str, Optional[str], Optional[str]], ...]:
+    """
+    One (flat_key, container, nested_key) step per field, worked out once
+    instead of re-checking prefixes for every message.
+    """
+    plan = []
+    for field in fields:
+        container = nested = None
+        for prefix in NESTED_PREFIXES:
+            if field.startswith(prefix + "_"):
+                container, nested = prefix, field[len(prefix) + 1:]
+                break
+        plan.append((field, container, nested))
+    return tuple(plan)
+
+
+FIELD_PLAN = compile_plan(FIELDS_ORDER)
+
+
+def extract_values(msg: Dict[str, Any], plan=FIELD_PLAN) -> tuple:
+    """Run the field plan over one Graylog message (flat key first, then the nested object)."""
+    get = msg.get
+    values = []
+    for field, container, nested in plan:
+        value = get(field, _MISSING)
+        if value is _MISSING:
+            value = None
+            if container is not None:
+                sub = get(container)
+                if isinstance(sub, dict):
+                    value = sub.get(nested)
+        values.append(value)
+    return tuple(values)
+
+
+class SuricataEvent(Mapping):
+    """
+    Compact, read-mostly record for one Suricata event.
+
+    Core FIELDS_ORDER values live in a tuple; fields attached later in the
+    pipeline go to a small side dict. It behaves like the dicts the planner
+    and detector already take (get / [] / items), and caches its JSON
+    encoding so the event is serialized at most once per pipeline pass.
+    """
+
+    __slots__ = ("_values", "_extra", "_json")
+
+    FIELDS = tuple(FIELDS_ORDER)
+    _INDEX = {f: i for i, f in enumerate(FIELDS_ORDER)}
+
+    def __init__(self, values: tuple, extra: Optional[Dict[str, Any]] = None, raw_json: Optional[str] = None):
+        self._values = values
+        self._extra = extra
+        self._json = raw_json
+
+    @classmethod
+    def from_message(cls, msg: Dict[str, Any]) -> "SuricataEvent":
+        return cls(extract_values(msg))
+
+    @classmethod
+    def from_dict(cls, log: Dict[str, Any], raw_json: Optional[str] = None) -> "SuricataEvent":
+        if isinstance(log, SuricataEvent):
+            return log
+        values = tuple(log.get(f) for f in cls.FIELDS)
+        extra = {k: v for k, v in log.items() if k not in cls._INDEX} or None
+        return cls(values, extra, raw_json)
+
+    # --- Mapping interface ---
+    def __getitem__(self, key):
+        i = self._INDEX.get(key)
+        if i is not None:
+            return self._values[i]
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        i = self._INDEX.get(key)
+        if i is not None:
+            return self._values[i]
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def __contains__(self, key):
+        return key in self._INDEX or (self._extra is not None and key in self._extra)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.FIELDS
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return len(self.FIELDS) + (len(self._extra) if self._extra else 0)
+
+    def __setitem__(self, key, value):
+        """
+        Attach or overwrite a field. A new field is appended to the cached JSON
+        (it encodes last, as in to_dict), so attaching the agg_* fields doesn't
+        throw away an encoding taken from the source line; overwriting drops it.
+        """
+        i = self._INDEX.get(key)
+        if i is not None:
+            self._values = self._values[:i] + (value,) + self._values[i + 1:]
+            self._json = None
+            return
+        if self._extra is None:
+            self._extra = {}
+        elif key in self._extra:
+            self._extra[key] = value
+            self._json = None
+            return
+        self._extra[key] = value
+        if self._json is not None:
+            self._json = _append_field(self._json, key, value)
+
+    def __repr__(self):
+        return f"SuricataEvent({self.to_dict()!r})"
+
+    # --- Serialization ---
+    def to_dict(self) -> Dict[str, Any]:
+        d = dict(zip(self.FIELDS, self._values))
+        if self._extra:
+            d.update(self._extra)
+        return d
+
+    def to_json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(self.to_dict(), ensure_ascii=False, default=str)
+        return self._json
+
+
+def _append_field(encoded: str, key: str, value) -> Optional[str]:
+    """encoded JSON object with `"key": value` added at the end; None if it isn't an object."""
+    body = encoded.rstrip()
+    if not body.endswith("}"):
+        return None
+    body = body[:-1].rstrip()
+    sep = "" if body.endswith("{") else ", "
+    return (f"{body}{sep}{json.dumps(key, ensure_ascii=False)}: "
+            f"{json.dumps(value, ensure_ascii=False, default=str)}}}")
+
+
+def event_json(log: Dict[str, Any]) -> str:
+    """JSON for a log: the cached encoding for SuricataEvent, json.dumps for plain dicts."""
+    if isinstance(log, SuricataEvent):
+        return log.to_json()
+    return json.dumps(log, default=str)
@@ -0,0 +1,206 @@
+# utils/host_stats.py
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+from .config import (
+    AGG_WINDOW_SECONDS, AGG_BUCKET_SECONDS, AGG_MAX_HOSTS, AGG_MAX_PAIRS,
+    AGG_MAX_PORTS_PER_HOST, AGG_MAX_SIGS_PER_HOST, AGG_EPHEMERAL_PORT_MIN
+)
+
+
+def event_time(log: Dict[str, Any]) -> float:
+    """Event timestamp as epoch seconds; wall clock when missing or unparsable."""
+    ts = log.get("timestamp")
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    if isinstance(ts, str):
+        try:
+            return datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+def flow_initiator(log: Dict[str, Any]) -> Tuple[Any, Any]:
+    """
+    (client ip, server port) of the log's flow. Suricata reports to_client
+    events (server replies) with src / dest swapped, so those are swapped back.
+    """
+    if (log.get("direction") or "").lower() == "to_client":
+        return log.get("dest_ip"), log.get("src_port")
+    return log.get("src_ip"), log.get("dest_port")
+
+
+class _Ring:
+    """Fixed number of time buckets; a slot is reset when a newer bucket reuses it."""
+
+    __slots__ = ("stamps", "counts")
+
+    def __init__(self, n: int):
+        self.stamps = [-1] * n
+        self.counts = [0] * n
+
+    def add(self, idx: int, amount: int = 1):
+        slot = idx % len(self.stamps)
+        if self.stamps[slot] != idx:
+            self.stamps[slot] = idx
+            self.counts[slot] = 0
+        self.counts[slot] += amount
+
+    def total(self, oldest: int) -> int:
+        return sum(c for s, c in zip(self.stamps, self.counts) if s >= oldest)
+
+
+class _Host:
+    __slots__ = ("last", "flows", "bytes", "ports", "sigs")
+
+    def __init__(self, n: int):
+        self.last = -1
+        self.flows = _Ring(n)
+        self.bytes = _Ring(n)
+        self.ports = {}  # dest_port -> last bucket seen
+        self.sigs = {}   # alert signature id -> _Ring
+
+
+class HostAggregator:
+    """
+    Rolling per-host counters over the last `window` seconds, kept in
+    `bucket`-second time buckets (event time, not arrival time), keyed on the
+    flow initiator (see flow_initiator) so a busy server's replies aren't
+    counted as that server scanning its clients:
+
+    - per client: flows, bytes, distinct server ports, alerts per signature
+    - per (client, server port): flows
+
+    Ports at or above `ephemeral_min` are not counted as distinct ports or
+    pairs: they are client-side ports, which a flow seen from the wrong side
+    would otherwise present as a fresh server port every time.
+
+    Memory is bounded: hosts and pairs are LRU-capped and dropped once idle
+    for a full window, and per-host port / signature tables are capped too.
+    Distinct ports are pruned once per bucket, so that count may include
+    ports last seen up to one bucket before the window.
+    """
+
+    def __init__(self, window: float = AGG_WINDOW_SECONDS, bucket: float = AGG_BUCKET_SECONDS,
+                 max_hosts: int = AGG_MAX_HOSTS, max_pairs: int = AGG_MAX_PAIRS,
+                 max_ports: int = AGG_MAX_PORTS_PER_HOST, max_sigs: int = AGG_MAX_SIGS_PER_HOST,
+                 ephemeral_min: int = AGG_EPHEMERAL_PORT_MIN):
+        self.bucket = float(bucket)
+        self.n_buckets = max(1, int(round(window / bucket)))
+        self.max_hosts = max_hosts
+        self.max_pairs = max_pairs
+        self.max_ports = max_ports
+        self.max_sigs = max_sigs
+        self.ephemeral_min = ephemeral_min
+        self._hosts = OrderedDict()  # client ip -> _Host, least recently seen first
+        self._pairs = OrderedDict()  # (client ip, server port) -> (last bucket, _Ring)
+        self._latest = -1            # newest bucket index seen
+        self._lock = threading.Lock()
+
+    def observe(self, log: Dict[str, Any]) -> Dict[str, int]:
+        """Count the log and attach the window totals to it as agg_* fields."""
+        with self._lock:
+            aggs = self._observe(log)
+        for k, v in aggs.items():
+            log[k] = v
+        return aggs
+
+    def observe_many(self, logs: List[Dict[str, Any]]) -> List[Dict[str, int]]:
+        with self._lock:
+            out = [self._observe(log) for log in logs]
+        for log, aggs in zip(logs, out):
+            for k, v in aggs.items():
+                log[k] = v
+        return out
+
+    def _observe(self, log: Dict[str, Any]) -> Dict[str, int]:
+        src, port = flow_initiator(log)
+        if not src:
+            return {}
+
+        idx = int(event_time(log) // self.bucket)
+        if idx > self._latest:
+            self._latest = idx
+        oldest = self._latest - self.n_buckets + 1
+        idx = max(idx, oldest)  # late events count towards the oldest live bucket
+
+        host = self._hosts.get(src)
+        if host is None:
+            host = self._hosts[src] = _Host(self.n_buckets)
+        else:
+            self._hosts.move_to_end(src)
+        if idx > host.last:
+            if host.last >= 0:
+                self._prune(host, oldest)
+            host.last = idx
+
+        host.flows.add(idx)
+        nbytes = _as_int(log.get("flow_bytes_toserver")) + _as_int(log.get("flow_bytes_toclient"))
+        if nbytes:
+            host.bytes.add(idx, nbytes)
+
+        pair_flows = 0
+        if port is not None and _as_int(port) < self.ephemeral_min:
+            if port in host.ports or len(host.ports) < self.max_ports:
+                host.ports[port] = idx
+            key = (src, port)
+            entry = self._pairs.get(key)
+            if entry is None:
+                ring = _Ring(self.n_buckets)
+            else:
+                ring = entry[1]
+                self._pairs.move_to_end(key)
+            ring.add(idx)
+            self._pairs[key] = (idx, ring)
+            pair_flows = ring.total(oldest)
+
+        sig_alerts = 0
+        if (log.get("event_type") or "").lower() == "alert":
+            sig = log.get("alert_signature_id") or log.get("alert_signature")
+            ring = host.sigs.get(sig)
+            if ring is None and len(host.sigs) < self.max_sigs:
+                ring = host.sigs[sig] = _Ring(self.n_buckets)
+            if ring is not None:
+                ring.add(idx)
+                sig_alerts = ring.total(oldest)
+
+        self._evict(oldest)
+        return {
+            "agg_src_flows": host.flows.total(oldest),
+            "agg_src_bytes": host.bytes.total(oldest),
+            "agg_src_ports": len(host.ports),
+            "agg_pair_flows": pair_flows,
+            "agg_sig_alerts": sig_alerts,
+        }
+
+    def _prune(self, host: _Host, oldest: int):
+        """Drop ports / signatures not seen inside the window (once per bucket per host)."""
+        host.ports = {p: i for p, i in host.ports.items() if i >= oldest}
+        host.sigs = {s: r for s, r in host.sigs.items() if r.total(oldest)}
+
+    def _evict(self, oldest: int):
+        hosts, pairs = self._hosts, self._pairs
+        while hosts:
+            src, host = next(iter(hosts.items()))
+            if len(hosts) <= self.max_hosts and host.last >= oldest:
+                break
+            hosts.popitem(last=False)
+        while pairs:
+            last = next(iter(pairs.values()))[0]
+            if len(pairs) <= self.max_pairs and last >= oldest:
+                break
+            pairs.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hosts": len(self._hosts), "pairs": len(self._pairs)}
+
+
+def _as_int(value) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
@@ -0,0 +1,134 @@
+# utils/keyword_matcher.py
+import bisect
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional
+from .events import event_json
+
+
+def _trie_regex(words: Iterable[str]) -> str:
+    """
+    Build a regex alternation factored as a prefix trie, e.g.
+    ["port scan", "port scanning"] -> "port\\ scan(?:ning)?". The regex engine
+    then walks shared prefixes once instead of retrying every keyword.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}  # end-of-word marker
+
+    def build(node: Dict[str, Any]) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        # greedy optional: prefer the longest keyword ending on this path
+        return "(?:" + body + ")?" if "" in node else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """
+    Precompiled substring matcher for the planner's keyword rules.
+
+    All keywords are matched in one regex pass over the selected text fields.
+    The lookahead makes every start position count, and keywords contained in
+    a longer match (e.g. "port scan" inside "port scanning") are added from a
+    precomputed table, so the result equals a separate `kw in text` test per
+    keyword. When fields is None the whole log is scanned as JSON (legacy mode).
+    """
+
+    def __init__(self, keywords: Iterable[str], fields: Optional[Iterable[str]] = None):
+        self.keywords = list(dict.fromkeys(k.lower() for k in keywords if k and "\0" not in k))
+        self.fields = list(fields) if fields is not None else None
+        order = {kw: i for i, kw in enumerate(self.keywords)}
+        self._implied = {
+            kw: sorted((k for k in self.keywords if k in kw), key=order.__getitem__)
+            for kw in self.keywords
+        }
+        self._order = order
+        self._pattern = re.compile("(?=(" + _trie_regex(self.keywords) + "))") if self.keywords else None
+
+    def text(self, log: Dict[str, Any]) -> str:
+        return self._raw_text(log).lower()
+
+    def _raw_text(self, log: Dict[str, Any]) -> str:
+        if self.fields is None:
+            return event_json(log)
+        return "\n".join([str(v) for v in map(log.get, self.fields) if v is not None])
+
+    def match_text(self, text: str) -> List[str]:
+        """Keywords found in (already lower-cased) text, in configured order."""
+        if self._pattern is None:
+            return []
+        hits = set()
+        for m in self._pattern.finditer(text):
+            kw = m.group(1)
+            if kw not in hits:
+                hits.update(self._implied[kw])
+        return sorted(hits, key=self._order.__getitem__)
+
+    def match(self, log: Dict[str, Any]) -> List[str]:
+        return self.match_text(self.text(log))
+
+    def match_many(self, logs: List[Dict[str, Any]]) -> List[List[str]]:
+        """
+        match() for a batch with a single regex pass: texts are joined with a
+        NUL separator (no keyword can span it) and hits are mapped back to
+        their log by offset.
+        """
+        if self._pattern is None:
+            return [[] for _ in logs]
+        texts = [self._raw_text(l).lower() for l in logs]
+        starts, pos = [], 0
+        for t in texts:
+            starts.append(pos)
+            pos += len(t) + 1
+        hits = [None] * len(logs)
+        for m in self._pattern.finditer("\0".join(texts)):
+            i = bisect.bisect_right(starts, m.start()) - 1
+            if hits[i] is None:
+                hits[i] = set()
+            hits[i].update(self._implied[m.group(1)])
+        return [sorted(h, key=self._order.__getitem__) if h else [] for h in hits]
+
+
+if __name__ == "__main__":
+    # Microbenchmark: python -m utils.keyword_matcher
+    import random
+    import string
+    import timeit
+    from utils.config import RBF_KEYWORDS, RBF_TEXT_FIELDS
+
+    sample = {
+        "timestamp": "2025-10-29T14:55:10.741Z", "event_type": "alert", "app_proto": "ssh", "proto": "TCP",
+        "src_ip": "192.168.56.10", "src_port": 22, "dest_ip": "192.168.56.1", "dest_port": 40582,
+        "direction": "to_client", "alert_signature_id": 2228000, "alert_signature": "SURICATA SSH invalid banner",
+        "alert_rev": 1, "alert_severity": 3, "alert_action": "allowed",
+        "alert_category": "Generic Protocol Command Decode", "fileinfo_filename": None, "fileinfo_size": None,
+        "fileinfo_state": None, "fileinfo_stored": None, "http_protocol": None, "http_hostname": None,
+        "http_http_method": None, "http_url": None, "http_status": None, "http_http_content_type": None,
+        "flow_id": 1480740619182091, "flow_pkts_toserver": 5, "flow_pkts_toclient": 5,
+        "flow_bytes_toserver": 361, "flow_bytes_toclient": 352, "flow_start": "2025-10-29T14:53:17.279225+0500",
+        "source": "autosentry-client", "filebeat_host_name": "autosentry-client",
+        "_id": "446c6c50-b4d7-11f0-a0ea-080027b4982b",
+    }
+    rng = random.Random(0)
+
+    def legacy(log, keywords):
+        text = json.dumps(log).lower()
+        return [kw for kw in keywords if kw in text]
+
+    print(f"{'keywords':>8} | {'legacy us/log':>13} | {'matcher us/log':>14} | speedup")
+    for n in (10, 100, 500, 1000):
+        extra = [" ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9)))
+                          for _ in range(rng.randint(1, 2))) for _ in range(max(0, n - len(RBF_KEYWORDS)))]
+        keywords = list(RBF_KEYWORDS) + extra
+        matcher = KeywordMatcher(keywords, RBF_TEXT_FIELDS)
+        loops = 2000
+        t_old = timeit.timeit(lambda: legacy(sample, keywords), number=loops) / loops * 1e6
+        t_new = timeit.timeit(lambda: matcher.match(sample), number=loops) / loops * 1e6
+        print(f"{len(keywords):>8} | {t_old:>13.2f} | {t_new:>14.2f} | {t_old / t_new:.1f}x")
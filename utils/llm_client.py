@@ -1,41 +1,505 @@
 # utils/llm_client.py
-import requests
 import json
-from typing import Optional
-from .config import OLLAMA_BASE, LLM_MODEL, LLM_TIMEOUT
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from typing import Any, Callable, Dict, List, Optional
 
-def call_llm(prompt: str, model: Optional[str] = None, timeout: int = None) -> str:
+import requests
+from requests.adapters import HTTPAdapter
+
+from .config import (
+    OLLAMA_BASE, LLM_MODEL, LLM_TIMEOUT, LLM_KEEP_ALIVE, LLM_JSON_MODE,
+    LLM_NUM_PREDICT, LLM_TEMPERATURE, LLM_POOL_SIZE, LLM_STREAM,
+    OLLAMA_ENDPOINTS, LLM_ENDPOINT_MAX_INFLIGHT, LLM_EJECT_AFTER_FAILURES, LLM_EJECT_SECONDS,
+    LLM_HEDGE, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_DELAY
+)
+
+
+class JSONValueScanner:
     """
-    Calls an Ollama-compatible API endpoint (e.g., local or Cloudflare tunnel).
-    Ensures NON-streaming response and returns the text cleanly.
+    Incremental scanner over streamed text. feed() returns every top-level
+    JSON object/array completed by the new chunk, tracking nesting and string
+    escapes so braces inside strings don't count.
     """
-    model = model or LLM_MODEL
-    timeout = timeout or LLM_TIMEOUT
-    url = f"{OLLAMA_BASE}/api/generate"
 
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "stream": False  # 👈 This disables streaming and forces one complete JSON response
-    }
-    headers = {"Content-Type": "application/json"}
+    def __init__(self):
+        self._buf = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        found = []
+        for ch in chunk:
+            if self._depth == 0:
+                if ch not in "{[":
+                    continue  # prose before / between values
+                self._buf = []
+            self._buf.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        found.append(json.loads("".join(self._buf)))
+                    except json.JSONDecodeError:
+                        pass
+        return found
+
+
+class LLMClient:
+    """
+    Ollama /api/generate client with a persistent, pooled HTTP session.
+    Every request carries keep_alive so the model stays resident between
+    bursts, and can be constrained to JSON output with a max-token cap.
+    """
+
+    def __init__(self, base_url: str = OLLAMA_BASE, model: str = LLM_MODEL, timeout: int = LLM_TIMEOUT,
+                 keep_alive: str = LLM_KEEP_ALIVE, json_mode: bool = LLM_JSON_MODE,
+                 num_predict: int = LLM_NUM_PREDICT, pool_size: int = LLM_POOL_SIZE,
+                 stream: bool = LLM_STREAM):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.json_mode = json_mode
+        self.num_predict = num_predict
+        self.stream = stream
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    def _payload(self, prompt: str, model: Optional[str], json_mode: Optional[bool],
+                 num_predict: Optional[int], stream: bool = False,
+                 context: Optional[List[int]] = None) -> Dict[str, Any]:
+        payload = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": {
+                "num_predict": num_predict or self.num_predict,
+                "temperature": LLM_TEMPERATURE,
+            },
+        }
+        if self.json_mode if json_mode is None else json_mode:
+            payload["format"] = "json"  # grammar allows a single top-level object, never a bare array
+        if context:
+            payload["context"] = context
+        return payload
+
+    def generate(self, prompt: str, model: Optional[str] = None, timeout: Optional[int] = None,
+                 json_mode: Optional[bool] = None, num_predict: Optional[int] = None,
+                 stream: Optional[bool] = None, stop_when: Optional[Callable[[Any], bool]] = None,
+                 context: Optional[List[int]] = None) -> Dict[str, Any]:
+        """
+        Returns {"text": str, "error": str|None, "timing": {...}}. timing holds the
+        wall-clock round trip plus Ollama's own load/prefill/generation figures.
 
-    try:
-        response = requests.post(url, json=payload, headers=headers, timeout=timeout)
-        response.raise_for_status()
+        In streaming mode the connection is closed as soon as a complete
+        top-level JSON value satisfying stop_when arrives (any complete value
+        when stop_when is None); "stopped_early" tells whether that happened.
+
+        `context` (from prime()) continues from an already-evaluated prefix,
+        so `prompt` only needs to carry the rest.
+        """
+        stream = self.stream if stream is None else stream
+        if stream:
+            return self._generate_stream(prompt, model, timeout, json_mode, num_predict, stop_when, context)
+
+        payload = self._payload(prompt, model, json_mode, num_predict, context=context)
+        started = time.perf_counter()
+        text, error, data = "", None, {}
 
-        # Try structured JSON
         try:
+            response = self.session.post(f"{self.base_url}/api/generate", json=payload,
+                                         timeout=timeout or self.timeout)
+            response.raise_for_status()
+
+            # Try structured JSON
+            try:
+                data = response.json()
+                if isinstance(data, dict) and "response" in data:
+                    text = data["response"].strip()
+                else:
+                    data = {}
+                    text = response.text.strip()
+            except json.JSONDecodeError:
+                # Fallback to plain text
+                text = response.text.strip()
+
+        except requests.exceptions.Timeout:
+            error = "llm_call_failed: request timed out"
+        except requests.exceptions.RequestException as e:
+            error = f"llm_call_failed: {str(e)}"
+
+        return {"text": text, "error": error, "timing": self._timing(started, data)}
+
+    def _generate_stream(self, prompt, model, timeout, json_mode, num_predict, stop_when,
+                         context=None) -> Dict[str, Any]:
+        payload = self._payload(prompt, model, json_mode, num_predict, stream=True, context=context)
+        started = time.perf_counter()
+        scanner = JSONValueScanner()
+        parts, error, data = [], None, {}
+        first_token_ms, stopped_early = None, False
+
+        try:
+            with self.session.post(f"{self.base_url}/api/generate", json=payload,
+                                   timeout=timeout or self.timeout, stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    chunk = data.get("response", "")
+                    if chunk:
+                        if first_token_ms is None:
+                            first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+                        parts.append(chunk)
+                        done = [v for v in scanner.feed(chunk) if stop_when is None or stop_when(v)]
+                        if done:
+                            # verdict is complete: drop the connection so the model stops generating
+                            stopped_early = not data.get("done", False)
+                            parts = [json.dumps(done[0])]
+                            break
+                    if data.get("done"):
+                        break
+        except requests.exceptions.Timeout:
+            error = "llm_call_failed: request timed out"
+        except requests.exceptions.RequestException as e:
+            error = f"llm_call_failed: {str(e)}"
+
+        timing = self._timing(started, data if data.get("done") else {})
+        timing["first_token_ms"] = first_token_ms
+        timing["stopped_early"] = stopped_early
+        return {"text": "".join(parts).strip(), "error": error, "timing": timing}
+
+    def warmup(self, model: Optional[str] = None) -> Dict[str, Any]:
+        """Load the model into memory (Ollama loads on an empty prompt) so the first detection doesn't pay for it."""
+        started = time.perf_counter()
+        try:
+            response = self.session.post(
+                f"{self.base_url}/api/generate",
+                json={"model": model or self.model, "prompt": "", "keep_alive": self.keep_alive, "stream": False},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            return {"ok": True, "timing": self._timing(started, response.json())}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return {"ok": False, "error": str(e), "timing": self._timing(started, {})}
+
+    def prime(self, prefix: str, model: Optional[str] = None) -> Optional[List[int]]:
+        """
+        Evaluate a fixed prompt prefix once and return Ollama's `context` for it
+        (None if the server doesn't return one). Ollama can't evaluate without
+        generating (num_predict 0 means unlimited), so one token is generated
+        and then cut off the end of the context using eval_count; without an
+        eval_count the context can't be trusted and None is returned.
+        """
+        payload = self._payload(prefix, model, json_mode=False, num_predict=1)
+        try:
+            response = self.session.post(f"{self.base_url}/api/generate", json=payload, timeout=self.timeout)
+            response.raise_for_status()
             data = response.json()
-            if isinstance(data, dict) and "response" in data:
-                return data["response"].strip()
-        except json.JSONDecodeError:
+            context, generated = data.get("context"), data.get("eval_count")
+        except (requests.exceptions.RequestException, ValueError, AttributeError):
+            return None
+        if not isinstance(context, list) or not isinstance(generated, int) or not 0 <= generated < len(context):
+            return None
+        return context[:len(context) - generated]
+
+    def close(self):
+        self.session.close()
+
+    @staticmethod
+    def _timing(started: float, data: Dict[str, Any]) -> Dict[str, Any]:
+        timing = {"elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+        # Ollama reports durations in nanoseconds
+        for src, dst in (("load_duration", "load_ms"), ("prompt_eval_duration", "prompt_eval_ms"),
+                         ("eval_duration", "eval_ms"), ("total_duration", "total_ms")):
+            if isinstance(data.get(src), (int, float)):
+                timing[dst] = round(data[src] / 1e6, 1)
+        for key in ("prompt_eval_count", "eval_count"):
+            if key in data:
+                timing[key] = data[key]
+        return timing
+
+
+def _percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class _Endpoint:
+    __slots__ = ("client", "url", "cap", "inflight", "calls", "errors", "failures",
+                 "ejected_until", "ejections", "probing", "latencies")
+
+    def __init__(self, client: LLMClient, cap: int):
+        self.client = client
+        self.url = client.base_url
+        self.cap = cap
+        self.inflight = 0
+        self.calls = 0
+        self.errors = 0
+        self.failures = 0          # consecutive
+        self.ejected_until = 0.0   # monotonic; 0 = healthy
+        self.ejections = 0
+        self.probing = False       # a probe request is deciding whether an ejected endpoint comes back
+        self.latencies = deque(maxlen=256)  # ms of recent successful calls
+
+
+class LLMPool:
+    """
+    Several Ollama endpoints behind the LLMClient interface (generate /
+    warmup / prime / close).
+
+    - routing: least outstanding requests (ties: fewest consecutive failures,
+      then latency), at most max_inflight per endpoint; callers wait when
+      every endpoint is full
+    - ejection: eject_after consecutive failures take an endpoint out for
+      eject_seconds; then a single probe request decides whether it returns
+    - hedging (optional): a call still running after the hedge_percentile
+      latency of recent calls is sent to a second endpoint as well, and the
+      first valid answer wins. The slower request runs to completion in the
+      background and still counts against its endpoint.
+    """
+
+    def __init__(self, endpoints: List[str] = None, max_inflight: int = LLM_ENDPOINT_MAX_INFLIGHT,
+                 eject_after: int = LLM_EJECT_AFTER_FAILURES, eject_seconds: float = LLM_EJECT_SECONDS,
+                 hedge: bool = LLM_HEDGE, hedge_percentile: float = LLM_HEDGE_PERCENTILE,
+                 hedge_min_delay: float = LLM_HEDGE_MIN_DELAY, **client_kwargs):
+        endpoints = list(endpoints or OLLAMA_ENDPOINTS)
+        if not endpoints:
+            raise ValueError("LLMPool needs at least one endpoint")
+        self.endpoints = [_Endpoint(LLMClient(url, pool_size=max_inflight, **client_kwargs), max_inflight)
+                          for url in endpoints]
+        self.model = self.endpoints[0].client.model
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedged = 0
+        self.hedge_wins = 0
+
+        self._cond = threading.Condition()
+        self._latencies = deque(maxlen=1024)  # ms of recent successful calls, all endpoints
+        self._executor = None
+        if hedge and len(self.endpoints) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=max_inflight * len(self.endpoints),
+                                                thread_name_prefix="llm-hedge")
+
+    # -------------------------------
+    # Routing / health
+    # -------------------------------
+    def _usable(self, ep: _Endpoint, now: float) -> bool:
+        if ep.inflight >= ep.cap or ep.ejected_until > now:
+            return False
+        return not (ep.ejected_until and ep.probing)  # one probe at a time after an ejection
+
+    def _acquire(self, exclude=(), block: bool = True) -> Optional[_Endpoint]:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                usable = [ep for ep in self.endpoints if ep not in exclude and self._usable(ep, now)]
+                if usable:
+                    # ties on in-flight count: fewest consecutive failures, then last latency; an endpoint
+                    # without a successful call yet ranks as the pool's median, not as the fastest
+                    default = 0.0
+                    if any(not e.latencies for e in usable):
+                        default = _percentile(self._latencies, 50) or 0.0
+                    ep = min(usable, key=lambda e: (e.inflight, e.failures, e.latencies[-1] if e.latencies else default))
+                    ep.inflight += 1
+                    if ep.ejected_until:
+                        ep.probing = True
+                    return ep
+                if not block:
+                    return None
+                # all busy or ejected: wake on a release, or when the first ejection runs out
+                ejected = [ep.ejected_until - now for ep in self.endpoints if ep.ejected_until > now]
+                self._cond.wait(min(ejected) if ejected else None)
+
+    def _release(self, ep: _Endpoint, result: Optional[Dict[str, Any]]):
+        with self._cond:
+            ep.inflight -= 1
+            ep.calls += 1
+            if result is None or result["error"]:
+                ep.errors += 1
+                ep.failures += 1
+                if ep.probing or ep.failures >= self.eject_after:
+                    ep.ejected_until = time.monotonic() + self.eject_seconds
+                    ep.ejections += 1
+            else:
+                ep.failures = 0
+                ep.ejected_until = 0.0
+                ep.latencies.append(result["timing"]["elapsed_ms"])
+                self._latencies.append(result["timing"]["elapsed_ms"])
+            ep.probing = False
+            self._cond.notify_all()
+
+    def _call(self, ep: _Endpoint, prompt: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        result = None
+        try:
+            result = ep.client.generate(prompt, **kwargs)
+        finally:
+            self._release(ep, result)
+        result["timing"]["endpoint"] = ep.url
+        return result
+
+    def hedge_delay(self) -> float:
+        """Seconds a call may run before it is hedged."""
+        with self._cond:
+            latencies = list(self._latencies)
+        if len(latencies) < 20:
+            return self.hedge_min_delay
+        return max(self.hedge_min_delay, _percentile(latencies, self.hedge_percentile) / 1000)
+
+    @staticmethod
+    def _valid(result: Dict[str, Any]) -> bool:
+        return not result["error"] and bool(result["text"])
+
+    # -------------------------------
+    # LLMClient interface
+    # -------------------------------
+    def generate(self, prompt: str, model: Optional[str] = None, timeout: Optional[int] = None,
+                 json_mode: Optional[bool] = None, num_predict: Optional[int] = None,
+                 stream: Optional[bool] = None, stop_when: Optional[Callable[[Any], bool]] = None,
+                 context: Optional[List[int]] = None) -> Dict[str, Any]:
+        """LLMClient.generate on the least loaded endpoint; timing["endpoint"] says which one answered."""
+        kwargs = {"model": model, "timeout": timeout, "json_mode": json_mode, "num_predict": num_predict,
+                  "stream": stream, "stop_when": stop_when, "context": context}
+        primary_ep = self._acquire()
+        if self._executor is None:
+            result = self._call(primary_ep, prompt, kwargs)
+        else:
+            result = self._hedged(primary_ep, prompt, kwargs)
+        if result["error"]:
+            # endpoint down or erroring: one more try elsewhere (without waiting for a free slot)
+            other = self._acquire(exclude=(primary_ep,), block=False)
+            if other is not None:
+                result = self._call(other, prompt, kwargs)
+                result["timing"]["retried"] = True
+        return result
+
+    def _hedged(self, primary_ep: _Endpoint, prompt: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        delay = self.hedge_delay()
+        primary = self._executor.submit(self._call, primary_ep, prompt, kwargs)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
             pass
+        tried = [primary_ep]
+        hedge_ep = self._acquire(exclude=tried, block=False)
+        if hedge_ep is None:
+            return primary.result()  # nowhere to hedge to right now
+        with self._cond:
+            self.hedged += 1
+
+        pending = {primary}
+        while hedge_ep is not None or pending:
+            if hedge_ep is not None:
+                tried.append(hedge_ep)
+                pending.add(self._executor.submit(self._call, hedge_ep, prompt, kwargs))
+                hedge_ep = None
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                result = fut.result()
+                if self._valid(result):
+                    result["timing"]["hedged_after_ms"] = round(delay * 1000, 1)
+                    if fut is not primary:
+                        with self._cond:
+                            self.hedge_wins += 1
+                    return result
+                if fut is not primary:
+                    hedge_ep = self._acquire(exclude=tried, block=False)  # hedge failed: try the next endpoint
+        return primary.result()  # no usable answer anywhere; report the original call
+
+    def warmup(self, model: Optional[str] = None) -> Dict[str, Any]:
+        """Load the model on every endpoint in parallel."""
+        with ThreadPoolExecutor(max_workers=len(self.endpoints)) as executor:
+            results = list(executor.map(lambda ep: ep.client.warmup(model), self.endpoints))
+        return {"ok": any(r["ok"] for r in results),
+                "endpoints": {ep.url: r for ep, r in zip(self.endpoints, results)}}
+
+    def prime(self, prefix: str, model: Optional[str] = None) -> Optional[List[int]]:
+        """
+        Context from the first healthy endpoint. Ollama contexts are token ids,
+        so they carry over to other endpoints serving the same model.
+        """
+        now = time.monotonic()
+        for ep in sorted(self.endpoints, key=lambda e: e.ejected_until > now):
+            context = ep.client.prime(prefix, model=model)
+            if context:
+                return context
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._cond:
+            endpoints = [{
+                "url": ep.url,
+                "inflight": ep.inflight,
+                "max_inflight": ep.cap,
+                "calls": ep.calls,
+                "errors": ep.errors,
+                "ejected": ep.ejected_until > now,
+                "ejections": ep.ejections,
+                "latency_p50_ms": _percentile(list(ep.latencies), 50),
+                "latency_p95_ms": _percentile(list(ep.latencies), 95),
+            } for ep in self.endpoints]
+            hedged, hedge_wins = self.hedged, self.hedge_wins
+        stats = {"endpoints": endpoints}
+        if self._executor is not None:
+            stats.update(hedged=hedged, hedge_wins=hedge_wins, hedge_delay_ms=round(self.hedge_delay() * 1000, 1))
+        return stats
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        for ep in self.endpoints:
+            ep.client.close()
 
-        # Fallback to plain text
-        return response.text.strip()
 
-    except requests.exceptions.Timeout:
-        return json.dumps({"error": "llm_call_failed: request timed out"})
-    except requests.exceptions.RequestException as e:
-        return json.dumps({"error": f"llm_call_failed: {str(e)}"})
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide shared client: an LLMPool when several OLLAMA_ENDPOINTS are configured, else one LLMClient."""
+    global _default_client
+    if _default_client is None:
+        with _default_lock:
+            if _default_client is None:
+                _default_client = LLMPool() if len(OLLAMA_ENDPOINTS) > 1 else LLMClient()
+    return _default_client
+
+
+def call_llm(prompt: str, model: Optional[str] = None, timeout: int = None) -> str:
+    """
+    Calls an Ollama-compatible API endpoint (e.g., local or Cloudflare tunnel).
+    Returns the text cleanly; with LLM_STREAM on it is cut at the first complete JSON value.
+    """
+    result = get_client().generate(prompt, model=model, timeout=timeout)
+    if result["error"]:
+        return json.dumps({"error": result["error"]})
+    return result["text"]
@@ -0,0 +1,273 @@
+# utils/prefilter.py
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .config import (
+    PREFILTER_MODEL_PATH, PREFILTER_HASH_BITS, PREFILTER_BENIGN_BELOW, PREFILTER_MALICIOUS_ABOVE,
+    LOCAL_LOG_PATH
+)
+
+# Suricata fields hashed as field=value
+CATEGORICAL_FIELDS = (
+    "event_type", "app_proto", "proto", "direction", "dest_port",
+    "alert_signature_id", "alert_severity", "alert_action", "alert_category",
+    "fileinfo_state", "fileinfo_stored",
+    "http_protocol", "http_hostname", "http_http_method", "http_status", "http_http_content_type",
+)
+# Counters hashed as field~log2 bucket
+NUMERIC_FIELDS = (
+    "fileinfo_size", "flow_pkts_toserver", "flow_pkts_toclient", "flow_bytes_toserver", "flow_bytes_toclient",
+    "agg_src_flows", "agg_src_bytes", "agg_src_ports", "agg_pair_flows", "agg_sig_alerts",
+)
+# Free text hashed as field:word
+TEXT_FIELDS = ("alert_signature", "http_url", "fileinfo_filename")
+
+_WORD = re.compile(r"[a-z0-9_.%-]{2,32}")
+
+
+def tokens(log: Dict[str, Any]) -> List[str]:
+    out = []
+    for field in CATEGORICAL_FIELDS:
+        value = log.get(field)
+        if value is not None and value != "":
+            out.append(f"{field}={str(value).lower()}")
+    for field in NUMERIC_FIELDS:
+        value = log.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            out.append(f"{field}~{int(math.log2(value + 1)) if value > 0 else 0}")
+    for field in TEXT_FIELDS:
+        value = log.get(field)
+        if isinstance(value, str):
+            out.extend(f"{field}:{w}" for w in set(_WORD.findall(value.lower())))
+    return out
+
+
+def hash_features(log: Dict[str, Any], bits: int = PREFILTER_HASH_BITS) -> np.ndarray:
+    """Indices of the active (binary) features; crc32 so they are stable across processes."""
+    mask = (1 << bits) - 1
+    return np.unique(np.fromiter((zlib.crc32(t.encode()) & mask for t in tokens(log)), dtype=np.int64))
+
+
+def _rows(logs: Iterable[Dict[str, Any]], bits: int) -> Tuple[np.ndarray, np.ndarray]:
+    """CSR-style (indptr, indices) for a batch of logs."""
+    rows = [hash_features(log, bits) for log in logs]
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(r) for r in rows], out=indptr[1:])
+    indices = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    return indptr, indices
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class LogisticPrefilter:
+    """
+    Logistic regression over hashed Suricata features, used by DetectionAgent
+    ahead of the LLM. Probabilities at or below benign_below / at or above
+    malicious_above are answered directly; the band in between goes to the LLM.
+    """
+
+    def __init__(self, bits: int = PREFILTER_HASH_BITS, weights: np.ndarray = None, bias: float = 0.0,
+                 benign_below: float = PREFILTER_BENIGN_BELOW, malicious_above: float = PREFILTER_MALICIOUS_ABOVE,
+                 meta: Dict[str, Any] = None):
+        self.bits = bits
+        self.weights = weights if weights is not None else np.zeros(1 << bits, dtype=np.float64)
+        self.bias = float(bias)
+        self.benign_below = benign_below
+        self.malicious_above = malicious_above
+        self.meta = dict(meta or {})
+        self.counts = {"scored": 0, "benign": 0, "malicious": 0, "uncertain": 0}
+        self._lock = threading.Lock()  # decide_many runs on several detection threads
+
+    # -------------------------------
+    # Inference
+    # -------------------------------
+    def _logits(self, indptr: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        sums = np.zeros(len(indptr) - 1)
+        nonempty = indptr[1:] > indptr[:-1]
+        if indices.size:
+            sums[nonempty] = np.add.reduceat(self.weights[indices], indptr[:-1][nonempty])
+        return sums + self.bias
+
+    def predict_proba_many(self, logs: List[Dict[str, Any]]) -> np.ndarray:
+        return _sigmoid(self._logits(*_rows(logs, self.bits)))
+
+    def decide_many(self, logs: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """A detection verdict per log when the model is confident, None for the uncertain band."""
+        if not logs:
+            return []
+        out = []
+        for p in self.predict_proba_many(logs).tolist():
+            if p >= self.malicious_above:
+                out.append({"verdict": "malicious", "score": round(p, 4), "reasons": ["prefilter_confident"],
+                            "recommended_action": "block_ip", "source": "prefilter"})
+            elif p <= self.benign_below:
+                out.append({"verdict": "benign", "score": round(p, 4), "reasons": ["prefilter_confident"],
+                            "recommended_action": "monitor", "source": "prefilter"})
+            else:
+                out.append(None)
+        decided = sum(1 for d in out if d is not None)
+        malicious = sum(1 for d in out if d is not None and d["verdict"] == "malicious")
+        with self._lock:
+            self.counts["scored"] += len(out)
+            self.counts["malicious"] += malicious
+            self.counts["benign"] += decided - malicious
+            self.counts["uncertain"] += len(out) - decided
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        scored = counts["scored"]
+        return dict(counts, benign_below=self.benign_below, malicious_above=self.malicious_above,
+                    llm_calls_avoided_rate=round((scored - counts["uncertain"]) / scored, 4) if scored else 0.0)
+
+    # -------------------------------
+    # Training
+    # -------------------------------
+    def fit(self, logs: List[Dict[str, Any]], labels: np.ndarray, epochs: int = 20, lr: float = 0.5,
+            l2: float = 1e-4, batch_size: int = 256, seed: int = 0):
+        """Mini-batch AdaGrad on log loss; labels are 0 (benign) / 1 (malicious)."""
+        indptr, indices = _rows(logs, self.bits)
+        y = np.asarray(labels, dtype=np.float64)
+        lengths = np.diff(indptr)
+        rng = np.random.default_rng(seed)
+        g2 = np.full_like(self.weights, 1e-8)
+        b2 = 1e-8
+        for _ in range(epochs):
+            order = rng.permutation(len(y))
+            for start in range(0, len(order), batch_size):
+                rows = np.sort(order[start:start + batch_size])
+                sub_ptr = np.zeros(len(rows) + 1, dtype=np.int64)
+                np.cumsum(lengths[rows], out=sub_ptr[1:])
+                sub_idx = np.concatenate([indices[indptr[r]:indptr[r + 1]] for r in rows])
+                err = _sigmoid(self._logits(sub_ptr, sub_idx)) - y[rows]
+
+                touched, inverse = np.unique(sub_idx, return_inverse=True)
+                grad = np.bincount(inverse, weights=np.repeat(err, lengths[rows]), minlength=len(touched))
+                grad = grad / len(rows) + l2 * self.weights[touched]
+                g2[touched] += grad * grad
+                self.weights[touched] -= lr * grad / np.sqrt(g2[touched])
+
+                gb = float(err.mean())
+                b2 += gb * gb
+                self.bias -= lr * gb / math.sqrt(b2)
+        return self
+
+    # -------------------------------
+    # Persistence
+    # -------------------------------
+    def save(self, path: str = PREFILTER_MODEL_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, weights=self.weights, bias=self.bias, bits=self.bits,
+                            meta=json.dumps(self.meta))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = PREFILTER_MODEL_PATH, **thresholds) -> "LogisticPrefilter":
+        with np.load(path) as data:
+            return cls(bits=int(data["bits"]), weights=data["weights"], bias=float(data["bias"]),
+                       meta=json.loads(str(data["meta"])), **thresholds)
+
+
+# -------------------------------
+# Offline training from traces.log + logs.ndjson
+# -------------------------------
+def _iter_jsonl(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def load_training_set(traces_path: str = "data/traces.log", logs_path: str = LOCAL_LOG_PATH):
+    """
+    (logs, labels) for every log the LLM gave a benign/malicious verdict.
+    Rule, prefilter, coalesced, deferred and parse-failed verdicts are left out
+    so the model only learns from the LLM. logs.ndjson is replayed through a
+    HostAggregator so the agg_* fields match what the planner attached live.
+    """
+    from .host_stats import HostAggregator
+
+    labels = {}
+    for trace in _iter_jsonl(traces_path):
+        det = trace.get("detection") or {}
+        if det.get("verdict") not in ("benign", "malicious") or det.get("source"):
+            continue
+        if "llm_parse_failed" in (det.get("reasons") or []):
+            continue
+        if (trace.get("coalesced") or {}).get("into") not in (None, trace.get("log_id")):
+            continue
+        if trace.get("log_id") is not None:
+            labels[str(trace["log_id"])] = 1 if det["verdict"] == "malicious" else 0
+
+    aggregator = HostAggregator()
+    logs, y = [], []
+    for log in _iter_jsonl(logs_path):
+        aggregator.observe(log)
+        key = str(log.get("_id") or log.get("flow_id"))
+        if key in labels:
+            logs.append(log)
+            y.append(labels.pop(key))
+    return logs, np.asarray(y, dtype=np.float64)
+
+
+def evaluate(model: LogisticPrefilter, logs: List[Dict[str, Any]], labels: np.ndarray) -> Dict[str, Any]:
+    """How much of `logs` the thresholds would answer, and how often that matches the LLM."""
+    p = model.predict_proba_many(logs)
+    y = np.asarray(labels)
+    decided = (p >= model.malicious_above) | (p <= model.benign_below)
+    agree = ((p >= 0.5) == (y == 1)) & decided
+    return {
+        "n": int(len(y)),
+        "llm_calls_avoided_rate": round(float(decided.mean()), 4) if len(y) else 0.0,
+        "decided_accuracy": round(float(agree.sum() / decided.sum()), 4) if decided.any() else None,
+        "accuracy_at_0.5": round(float(((p >= 0.5) == (y == 1)).mean()), 4) if len(y) else None,
+        "brier": round(float(np.mean((p - y) ** 2)), 4) if len(y) else None,
+    }
+
+
+if __name__ == "__main__":
+    # Train: python -m utils.prefilter [--traces data/traces.log] [--logs data/logs.ndjson]
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the DetectionAgent pre-classifier from past LLM verdicts")
+    parser.add_argument("--traces", default="data/traces.log")
+    parser.add_argument("--logs", default=LOCAL_LOG_PATH)
+    parser.add_argument("--out", default=PREFILTER_MODEL_PATH)
+    parser.add_argument("--bits", type=int, default=PREFILTER_HASH_BITS)
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--holdout", type=float, default=0.2, help="fraction kept aside for the report")
+    args = parser.parse_args()
+
+    logs, y = load_training_set(args.traces, args.logs)
+    if len(y) < 10 or len(set(y.tolist())) < 2:
+        raise SystemExit(f"need LLM verdicts of both classes to train, found {len(y)} "
+                         f"({int(y.sum())} malicious)")
+    order = np.random.default_rng(0).permutation(len(y))
+    cut = int(len(y) * (1 - args.holdout))
+    train, test = order[:cut], order[cut:]
+
+    model = LogisticPrefilter(bits=args.bits).fit([logs[i] for i in train], y[train], epochs=args.epochs)
+    report = evaluate(model, [logs[i] for i in test], y[test]) if len(test) else {}
+    model.meta = {"trained_on": int(len(train)), "malicious_rate": round(float(y[train].mean()), 4),
+                  "holdout": report}
+    model.save(args.out)
+    print(f"Trained on {len(train)} LLM verdicts ({int(y[train].sum())} malicious) → {args.out}")
+    if report:
+        print(f"Holdout ({report['n']}): LLM calls avoided {report['llm_calls_avoided_rate']:.1%} at "
+              f"benign ≤ {model.benign_below} / malicious ≥ {model.malicious_above}, "
+              f"agreement on those {report['decided_accuracy']}, brier {report['brier']}")
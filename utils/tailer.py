@@ -0,0 +1,274 @@
+# utils/tailer.py
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .events import SuricataEvent
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+_EVENT = struct.Struct("iIII")  # struct inotify_event: wd, mask, cookie, len (name follows)
+
+
+class _Inotify:
+    """
+    Minimal ctypes binding: one directory watch, wait() until the watched
+    file name changes. Events for other files in the directory (trace logs,
+    the offset file's tmp + rename, ...) are read and ignored.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.name = os.fsencode(name)
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], max(0.0, deadline - time.monotonic()))
+            if not ready:
+                return False
+            if self._relevant():
+                return True
+
+    def _relevant(self) -> bool:
+        """Drain pending events; True if any concerns the watched name (or the queue overflowed)."""
+        hit = False
+        try:
+            while True:
+                buf = os.read(self.fd, 64 * 1024)
+                if not buf:
+                    break
+                pos = 0
+                while pos + _EVENT.size <= len(buf):
+                    _, mask, _, length = _EVENT.unpack_from(buf, pos)
+                    name = buf[pos + _EVENT.size:pos + _EVENT.size + length].rstrip(b"\0")
+                    if mask & IN_Q_OVERFLOW or name == self.name:
+                        hit = True
+                    pos += _EVENT.size + length
+        except BlockingIOError:
+            pass
+        return hit
+
+    def close(self):
+        os.close(self.fd)
+
+
+class NDJSONTailer:
+    """
+    Follows an append-only NDJSON file and yields batches of decoded objects.
+
+    - wakes on inotify (Linux), falls back to polling every poll_interval
+    - reads at most chunk_size bytes per call, only decoding complete lines,
+      so a large backlog is handed out in pieces rather than loaded at once
+    - decodes with JSONDecoder.raw_decode (nested objects, several per line)
+      into SuricataEvents that keep their source text as the cached JSON, so
+      writing or prompting with an unchanged event doesn't re-encode it
+    - survives rotation (new inode) and truncation (size < offset)
+    - persists the byte offset in offset_path on commit(position). With
+      poll_marked() every object comes with the (inode, end offset) of its
+      line, so a caller holding objects in a buffer commits only up to the
+      last one it processed; a crash then replays exactly the unprocessed
+      ones (commit() with no position covers everything read so far)
+    """
+
+    def __init__(self, path: str, offset_path: Optional[str] = None, chunk_size: int = 1 << 20,
+                 poll_interval: float = 0.5, start_at_end: bool = True):
+        self.path = path
+        self.offset_path = offset_path
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self._decoder = json.JSONDecoder()
+        self._fh = None
+        self._inode = None
+        self._offset = 0        # bytes of complete lines consumed
+        self._acked = None      # (inode, offset) last persisted
+        self._partial = b""
+
+        try:
+            self._notify = _Inotify(os.path.dirname(os.path.abspath(path)), os.path.basename(path))
+        except (OSError, AttributeError):
+            self._notify = None  # non-Linux or inotify unavailable → polling
+
+        self._open(self._load_offset(), start_at_end)
+
+    # -------------------------------
+    # Offset persistence
+    # -------------------------------
+    def _load_offset(self) -> Optional[Dict[str, int]]:
+        if not self.offset_path or not os.path.exists(self.offset_path):
+            return None
+        try:
+            with open(self.offset_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def commit(self, position: Optional[Tuple[int, int]] = None):
+        """
+        Persist `position` (an (inode, offset) mark from poll_marked), or the
+        offset of everything read so far when None.
+        """
+        state = tuple(position) if position is not None else (self._inode, self._offset)
+        if not self.offset_path or state == self._acked:
+            return
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"inode": state[0], "offset": state[1]}, f)
+        os.replace(tmp, self.offset_path)
+        self._acked = state
+
+    # -------------------------------
+    # File handling
+    # -------------------------------
+    def _open(self, saved: Optional[Dict[str, int]] = None, start_at_end: bool = False):
+        try:
+            fh = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        st = os.fstat(fh.fileno())
+        if saved and saved.get("inode") == st.st_ino and 0 <= saved.get("offset", -1) <= st.st_size:
+            offset = saved["offset"]  # resume where we left off
+        elif saved is None and start_at_end:
+            offset = st.st_size
+        else:
+            offset = 0  # rotated while we were away, or a fresh file
+        fh.seek(offset)
+        self._fh, self._inode, self._offset, self._partial = fh, st.st_ino, offset, b""
+
+    def _check_rotation(self) -> bool:
+        """Returns True when the path now points at a different file or was truncated."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False  # mid-rotation; keep draining the old handle
+        if self._fh is None:
+            return True
+        if st.st_ino != self._inode:
+            return True
+        if st.st_size < self._fh.tell():
+            # truncated in place: start over from the top
+            self._fh.seek(0)
+            self._offset, self._partial = 0, b""
+        return False
+
+    # -------------------------------
+    # Reading
+    # -------------------------------
+    def _decode_line(self, line: bytes, out: List[tuple]):
+        """Append (position, obj) for each object on the line; position marks the line's end."""
+        position = (self._inode, self._offset)
+        text = line.decode("utf-8", errors="replace")
+        idx = text.find("{")
+        while idx != -1:
+            try:
+                obj, end = self._decoder.raw_decode(text, idx)
+            except ValueError:
+                idx = text.find("{", idx + 1)  # skip garbage up to the next object
+                continue
+            if isinstance(obj, dict):
+                out.append((position, SuricataEvent.from_dict(obj, raw_json=text[idx:end])))
+            idx = text.find("{", end)
+
+    def _drain(self, out: List[tuple]) -> bool:
+        """Read one chunk; returns True when the file had nothing more to give (EOF)."""
+        if self._fh is None:
+            return True
+        chunk = self._fh.read(self.chunk_size)
+        if not chunk:
+            return True
+        data = self._partial + chunk
+        lines = data.split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._offset += len(line) + 1
+            if line.strip():
+                self._decode_line(line, out)
+        return len(chunk) < self.chunk_size
+
+    def _read_some(self, out: List[tuple]) -> bool:
+        """Chunks until at least one object decodes or EOF; returns True at EOF."""
+        while True:
+            eof = self._drain(out)
+            if eof or out:
+                return eof
+
+    def read_marked(self) -> List[tuple]:
+        """
+        (position, obj) for complete objects appended since the last call,
+        about one chunk's worth at most (non-blocking); call again for the
+        rest of a backlog.
+        """
+        out = []
+        if not self._read_some(out) or out:
+            return out
+        if self._check_rotation():
+            if not self._read_some(out) or out:
+                return out  # finish the rotated-away file first
+            if self._fh is not None:
+                self._fh.close()
+            self._fh = None
+            self._open()
+            self._read_some(out)
+        return out
+
+    def _wait(self, timeout: float):
+        if self._notify is not None:
+            self._notify.wait(timeout)
+        else:
+            time.sleep(min(timeout, self.poll_interval))
+
+    def read_available(self) -> List[Dict[str, Any]]:
+        return [obj for _, obj in self.read_marked()]
+
+    def poll_marked(self, timeout: float) -> List[tuple]:
+        """Next batch of (position, obj); empty after `timeout` seconds idle."""
+        deadline = time.monotonic() + timeout
+        while True:
+            batch = self.read_marked()
+            remaining = deadline - time.monotonic()
+            if batch or remaining <= 0:
+                return batch
+            self._wait(remaining)
+
+    def poll(self, timeout: float) -> List[Dict[str, Any]]:
+        """Next batch of objects; empty after `timeout` seconds idle."""
+        return [obj for _, obj in self.poll_marked(timeout)]
+
+    def __iter__(self) -> Iterator[List[Dict[str, Any]]]:
+        while True:
+            self.commit()  # previous batch has been consumed
+            batch = self.poll(self.poll_interval)
+            if batch:
+                yield batch
+
+    def close(self):
+        """Release handles; the offset is only persisted by commit()."""
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        if self._notify is not None:
+            self._notify.close()
+            self._notify = None
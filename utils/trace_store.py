@@ -0,0 +1,208 @@
+# utils/trace_store.py
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from .config import TRACE_DB_PATH, TRACE_DB_RETENTION_DAYS, TRACE_DB_MAX_ROWS, TRACE_DB_COMPACT_INTERVAL
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS traces (
+    id                INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts                REAL NOT NULL,
+    log_id            TEXT,
+    src_ip            TEXT,
+    planner_verdict   TEXT,
+    planner_score     REAL,
+    detection_verdict TEXT,
+    detection_score   REAL,
+    response_action   TEXT,
+    doc               TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_traces_ts ON traces (ts);
+CREATE INDEX IF NOT EXISTS idx_traces_log_id ON traces (log_id);
+CREATE INDEX IF NOT EXISTS idx_traces_src_ip_ts ON traces (src_ip, ts);
+CREATE INDEX IF NOT EXISTS idx_traces_planner_verdict_ts ON traces (planner_verdict, ts);
+CREATE INDEX IF NOT EXISTS idx_traces_detection_verdict_ts ON traces (detection_verdict, ts);
+CREATE INDEX IF NOT EXISTS idx_traces_detection_score ON traces (detection_score);
+"""
+
+_VERDICT_COLUMNS = {"planner": "planner_verdict", "detection": "detection_verdict"}
+
+
+def to_epoch(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+def _as_float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TraceStore:
+    """
+    Local SQLite store for pipeline traces (WAL mode, batched inserts).
+
+    The full trace is kept as JSON in `doc`; the columns queried by the
+    dashboard and analysts (log_id, src_ip, verdicts, scores, time) are
+    indexed. Readers in other processes open their own TraceStore on the
+    same file; WAL lets them read while the pipeline writes.
+    """
+
+    def __init__(self, path: str = TRACE_DB_PATH, retention_days: float = TRACE_DB_RETENTION_DAYS,
+                 max_rows: int = TRACE_DB_MAX_ROWS, compact_interval: float = TRACE_DB_COMPACT_INTERVAL):
+        self.path = path
+        self.retention_days = retention_days
+        self.max_rows = max_rows
+        self.compact_interval = compact_interval
+        self._next_compact = time.monotonic() + compact_interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    # -------------------------------
+    # Writes
+    # -------------------------------
+    def insert_many(self, traces: List[Dict[str, Any]], docs: Optional[List[str]] = None) -> int:
+        """
+        Insert a batch in one transaction. `docs` may carry the traces already
+        serialized to JSON (e.g. the JSONL lines) so they aren't encoded twice.
+        Runs compact() when compact_interval has elapsed.
+        """
+        rows = []
+        for i, t in enumerate(traces):
+            planner = t.get("planner") or {}
+            detection = t.get("detection") or {}
+            response = t.get("response") or {}
+            rows.append((
+                to_epoch(t.get("logged_at")),
+                None if t.get("log_id") is None else str(t.get("log_id")),
+                t.get("src_ip"),
+                planner.get("verdict"),
+                _as_float(planner.get("score")),
+                detection.get("verdict"),
+                _as_float(detection.get("score")),
+                response.get("action"),
+                docs[i] if docs is not None else json.dumps(t, default=str),
+            ))
+        if not rows:
+            return 0
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO traces (ts, log_id, src_ip, planner_verdict, planner_score, detection_verdict,"
+                " detection_score, response_action, doc) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        if self.compact_interval and time.monotonic() >= self._next_compact:
+            self._next_compact = time.monotonic() + self.compact_interval
+            self.compact()
+        return len(rows)
+
+    def compact(self) -> int:
+        """Apply the retention policy (age + row cap) and checkpoint the WAL. Returns rows deleted."""
+        deleted = 0
+        with self._lock, self._conn:
+            if self.retention_days:
+                cutoff = time.time() - self.retention_days * 86400
+                deleted += self._conn.execute("DELETE FROM traces WHERE ts < ?", (cutoff,)).rowcount
+            if self.max_rows:
+                row = self._conn.execute("SELECT MAX(id) FROM traces").fetchone()
+                if row[0] is not None:
+                    deleted += self._conn.execute(
+                        "DELETE FROM traces WHERE id <= ?", (row[0] - self.max_rows,)).rowcount
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return deleted
+
+    # -------------------------------
+    # Queries
+    # -------------------------------
+    def _select(self, where: str = "", params: tuple = (), order: str = "id DESC",
+                limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT id, doc FROM traces"
+        if where:
+            sql += " WHERE " + where
+        sql += " ORDER BY " + order
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        out = []
+        for r in rows:
+            doc = json.loads(r["doc"])
+            doc["_row_id"] = r["id"]
+            out.append(doc)
+        return out
+
+    def recent(self, n: int = 50) -> List[Dict[str, Any]]:
+        """Newest n traces, newest first."""
+        return self._select(limit=n)
+
+    def since_id(self, last_id: int, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Traces inserted after row id `last_id`, oldest first (for incremental readers)."""
+        return self._select("id > ?", (last_id,), order="id ASC", limit=limit)
+
+    def by_verdict(self, verdict: str, stage: str = "detection", since: Optional[float] = None,
+                   limit: int = 500) -> List[Dict[str, Any]]:
+        column = _VERDICT_COLUMNS[stage]
+        if since is None:
+            return self._select(f"{column} = ?", (verdict,), limit=limit)
+        return self._select(f"{column} = ? AND ts >= ?", (verdict, since), order="ts DESC", limit=limit)
+
+    def by_ip(self, src_ip: str, since: Optional[float] = None, until: Optional[float] = None,
+              verdict: Optional[str] = None, limit: int = 500) -> List[Dict[str, Any]]:
+        """e.g. all malicious verdicts for an IP in the last hour: by_ip(ip, since=time.time()-3600, verdict="malicious")"""
+        where, params = ["src_ip = ?"], [src_ip]
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("ts < ?")
+            params.append(until)
+        if verdict is not None:
+            where.append("detection_verdict = ?")
+            params.append(verdict)
+        return self._select(" AND ".join(where), tuple(params), order="ts DESC", limit=limit)
+
+    def time_range(self, start: float, end: float, limit: int = 1000) -> List[Dict[str, Any]]:
+        return self._select("ts >= ? AND ts < ?", (start, end), order="ts DESC", limit=limit)
+
+    def counts_per_bucket(self, bucket_seconds: int = 60, since: Optional[float] = None,
+                          until: Optional[float] = None, stage: str = "detection") -> List[Dict[str, Any]]:
+        """[{"bucket": epoch_start, "verdict": ..., "count": n}, ...] ordered by bucket."""
+        column = _VERDICT_COLUMNS[stage]
+        since = time.time() - 3600 if since is None else since
+        until = time.time() if until is None else until
+        sql = (f"SELECT CAST(ts / ? AS INTEGER) * ? AS bucket, {column} AS verdict, COUNT(*) AS count "
+               f"FROM traces WHERE ts >= ? AND ts < ? GROUP BY bucket, verdict ORDER BY bucket")
+        with self._lock:
+            rows = self._conn.execute(sql, (bucket_seconds, bucket_seconds, since, until)).fetchall()
+        return [dict(r) for r in rows]
+
+    def counts(self, stage: str = "detection", since: Optional[float] = None) -> Dict[str, int]:
+        column = _VERDICT_COLUMNS[stage]
+        sql = f"SELECT {column} AS verdict, COUNT(*) AS count FROM traces"
+        params = ()
+        if since is not None:
+            sql += " WHERE ts >= ?"
+            params = (since,)
+        with self._lock:
+            rows = self._conn.execute(sql + " GROUP BY verdict", params).fetchall()
+        return {r["verdict"]: r["count"] for r in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
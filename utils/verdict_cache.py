@@ -0,0 +1,75 @@
+# utils/verdict_cache.py
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from typing import Any, Dict, Iterable, Optional
+
+
+def fingerprint(log: Dict[str, Any], volatile_fields: Iterable[str]) -> str:
+    """
+    Stable key for a log with volatile fields (ids, timestamps, ports, counters)
+    removed. Entries in volatile_fields may be glob patterns, e.g. "flow_bytes_*".
+    """
+    patterns = tuple(volatile_fields)
+    kept = {
+        k: v for k, v in log.items()
+        if v is not None and not any(fnmatchcase(k, p) for p in patterns)
+    }
+    return json.dumps(kept, sort_keys=True, default=str)
+
+
+class VerdictCache:
+    """Thread-safe LRU cache with per-entry TTL for DetectionAgent verdicts."""
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, verdict)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, verdict = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(verdict)
+
+    def put(self, key: str, verdict: Dict[str, Any]):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, copy.deepcopy(verdict))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }